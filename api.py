@@ -1,177 +1,599 @@
 from email import policy
+import logging
 import os
 import json
 import random
 import time
 import re
 from base64 import b64decode
+from datetime import datetime
 import json
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-from model import get_ai_content
-import html
+from flask import Flask, request, jsonify, Response
+from model import get_ai_content, invalidate_ai_content
 import requests
-from utils import get_email_intent, verify_policy,verify_policy_details
-from dbOperations import init_db, store_conversation, get_conversation_body, validate_conversation_id
+import guidewire
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+import threading
+import hashlib
+import sqlite3
+from utils import verify_policy,verify_policy_details
+from dbOperations import init_db, store_conversation, store_conversations, get_conversation_state, \
+    store_fnol_payload, start_compaction_job, get_storage_report, get_connection
 from verify import validate_claim
+from claim_index import claim_index
+from extractor import try_fast_path, stats as extractor_stats
+from cache import TTLCache, prompt_cache
+from singleflight import SingleFlight
+from ratelimit import gemini_limiter
+from policy_parser import parse_policy, build_policy_context, context_stats
+from fnol import (load_claim_template, format_master_data, validate_fnol_payload, complete_fnol_payload,
+                  claim_response_schema)
+from json_parser import parse_json_response, parse_stats
+from htmltext import html_to_text, read_email_body
+import metrics
+from metrics import span, timed
+from emailtrim import trim_email, stats as trim_stats
+from jobQueue import init_job_db, enqueue_job, get_job, start_job_workers, is_allowed_callback, prune_jobs
+from logconfig import configure_logging, conversation_id_var, submit_with_context
+from intent import classify_intent, stats as intent_stats
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Create Flask app
 app = Flask(__name__)
 
+# Set by serve.py when a shutdown starts, so load balancers stop sending new requests
+shutting_down = threading.Event()
+
 init_db()
+start_compaction_job(extra_tasks=(prune_jobs,))
+
+# Shared pool for the PolicyCenter and ClaimCenter calls that run in parallel for each email. Each
+# request being served runs two of them, so the pool defaults to twice the server thread count.
+INTAKE_WORKERS = int(os.getenv("intake_workers", str(2 * int(os.getenv("serve_threads", "200")))))
+intake_executor = ThreadPoolExecutor(max_workers=INTAKE_WORKERS, thread_name_prefix="intake")
+
+# Read-through cache of PolicyCenter responses keyed by policy number
+policy_cache = TTLCache(
+    maxsize=int(os.getenv("policy_cache_size", "1000")),
+    ttl=int(os.getenv("policy_cache_ttl", "900"))
+)
+POLICY_CACHE_NEGATIVE_TTL = int(os.getenv("policy_cache_negative_ttl", "120"))
+POLICY_NOT_FOUND = "PolicyNotFound"
+
+# Bounds for the bulk intake endpoint
+BATCH_WORKERS = int(os.getenv("batch_workers", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("batch_max_items", "500"))
+# Batch requests above this size are rejected with 413 before the body is read
+BATCH_MAX_BYTES = int(os.getenv("max_request_bytes", str(20 * 1024 * 1024)))
+
+# "staged" extracts the policy fields and generates the claim payload in separate Gen AI calls,
+# "single_call" gets both, with the email intent, from one structured extraction call
+PIPELINE_MODE = os.getenv("pipeline_mode", "staged")
+
+# In-flight coalescing per request and per (policy number, loss date), and replay protection
+request_flight = SingleFlight()
+claim_flight = SingleFlight()
+idempotency_cache = TTLCache(
+    maxsize=int(os.getenv("idempotency_cache_size", "10000")),
+    ttl=int(os.getenv("idempotency_window_seconds", "600"))
+)
+
+# createFNOL retries: transient failures resend the same payload after a backoff
+FNOL_MAX_ATTEMPTS = 3
+FNOL_RETRY_BASE_DELAY = float(os.getenv("fnol_retry_base_delay", "1"))
+FNOL_TRANSIENT_STATUS_CODES = (408, 425, 429)
+# A payload regenerated after a rejection bypasses the prompt cache; at temperature 0 Gen AI would
+# mostly return the same payload again
+FNOL_REGENERATE_TEMPERATURE = float(os.getenv("fnol_regenerate_temperature", "0.4"))
 
 @app.route("/onPrem/v2/createClaim", methods=["POST"])
 def create_claim():
-    try:
-        conversation_id = request.headers.get("ConversationID")
-        if not conversation_id and request.is_json:
-            conversation_id = request.json.get("ConversationID")
-        
-        # Extract and clean HTML content
-        html_content = request.get_data(as_text=True)
-        
-        soup = BeautifulSoup(html_content, "html.parser")
-        plain_text = soup.get_text(separator=" ")
-        decoded_text = html.unescape(plain_text)
-        cleaned_text = re.sub(r'(\\n|/n|\n|\r)', ' ', decoded_text)
-        cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
+    # Read the body up to the input cap, skipping inline images, instead of loading all of it
+    html_content = read_email_body(request.stream)
 
-        
-        if not validate_conversation_id(conversation_id):
+    conversation_id = request.headers.get("ConversationID")
+    if not conversation_id and request.is_json:
+        try:
+            conversation_id = json.loads(html_content).get("ConversationID")
+        except (ValueError, AttributeError):
+            conversation_id = None
+
+    # Async mode: persist the job and let a background worker run the pipeline
+    if "respond-async" in request.headers.get("Prefer", "") or request.args.get("mode") == "async":
+        callback_url = request.headers.get("CallbackURL") or request.args.get("callbackUrl")
+        if callback_url and not is_allowed_callback(callback_url):
+            return jsonify({
+                "message": "CallbackURL host is not allowed",
+                "action": "InvalidRequest"
+            }), 400
+        job_id = enqueue_job(conversation_id, html_content, callback_url)
+        status_url = f"/onPrem/v2/jobs/{job_id}"
+        return jsonify({
+            "jobId": job_id,
+            "status": "queued",
+            "statusUrl": status_url,
+            "resultUrl": f"{status_url}/result",
+            "action": "Accepted"
+        }), 202, {"Location": status_url}
+
+    result, status_code = handle_email(conversation_id, html_content, idempotency_key=request.headers.get("Idempotency-Key"))
+    return jsonify(result), status_code
+
+
+@app.route("/onPrem/v2/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"jobId": job_id, "message": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+# Returns the same JSON and status code create_claim returns once the job has finished
+@app.route("/onPrem/v2/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"jobId": job_id, "message": "Job not found"}), 404
+    if job["status"] in ("queued", "running"):
+        return jsonify({"jobId": job_id, "status": job["status"]}), 202
+    return jsonify(job["result"]), job["statusCode"]
+
+
+# Bulk intake: accepts a JSON array of {"ConversationID", "body"} items and streams one
+# NDJSON line per item as soon as it finishes
+@app.route("/onPrem/v2/createClaim/batch", methods=["POST"])
+def create_claim_batch():
+    if request.content_length is not None and request.content_length > BATCH_MAX_BYTES:
+        return jsonify({
+            "message": f"Batch request exceeds the limit of {BATCH_MAX_BYTES} bytes",
+            "action": "InvalidRequest"
+        }), 413
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = items.get("items")
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return jsonify({
+            "message": "Request body must be a JSON array of {ConversationID, body} objects",
+            "action": "InvalidRequest"
+        }), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({
+            "message": f"Batch size exceeds the limit of {BATCH_MAX_ITEMS} items",
+            "action": "InvalidRequest"
+        }), 413
+
+    policy_lookup = BatchPolicyLookup()
+    conversation_writer = BatchConversationWriter()
 
-            # Calling the extract policy details function to get the policy details,
-            #  and extract policy number and loss date using Gen AI
-            policy_details, policy_number, loss_date = extract_policy_details(cleaned_text)
-            if policy_details is None:
-                return jsonify({
+    def generate():
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(items))),
+                                    thread_name_prefix="batch") as pool:
+                futures = {
+                    pool.submit(handle_email, item.get("ConversationID"), item.get("body") or "", policy_lookup,
+                                item.get("IdempotencyKey"), conversation_writer): index
+                    for index, item in enumerate(items)
+                }
+                for future in as_completed(futures):
+                    index = futures[future]
+                    result, status_code = future.result()
+                    yield json.dumps({
+                        "index": index,
+                        "ConversationID": items[index].get("ConversationID"),
+                        "statusCode": status_code,
+                        "result": result
+                    }) + "\n"
+        finally:
+            conversation_writer.flush()
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+# Policy lookup shared by the items of one batch, so a policy is fetched at most once per batch
+class BatchPolicyLookup:
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, policy_number):
+        with self._lock:
+            future = self._futures.get(policy_number)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[policy_number] = future
+
+        if owner:
+            try:
+                future.set_result(fetch_policy_details(policy_number))
+            except Exception as e:
+                future.set_exception(e)
+
+        return future.result()
+
+
+# Conversation writer of one batch: the conversations are collected and stored in a single
+# transaction once every item has finished. A follow-up sent in the same batch as its
+# conversation is therefore handled as a new email.
+class BatchConversationWriter:
+
+    def __init__(self):
+        self._conversations = []
+        self._lock = threading.Lock()
+
+    def __call__(self, conversation_id, body, policy_number=None, loss_date=None, policy_status=None,
+                 duplicate_result=None, fnol_payload=None):
+        with self._lock:
+            self._conversations.append({
+                "conversation_id": conversation_id, "body": body, "policy_number": policy_number,
+                "loss_date": loss_date, "policy_status": policy_status, "duplicate_result": duplicate_result,
+                "fnol_payload": fnol_payload,
+            })
+
+    def flush(self):
+        with self._lock:
+            conversations, self._conversations = self._conversations, []
+        if conversations:
+            store_conversations(conversations)
+
+
+# Function to derive the idempotency key of a request that did not send one: a redelivered
+# message has the same conversation ID and body
+def make_idempotency_key(conversation_id, html_content):
+    digest = hashlib.sha256(html_content.encode("utf-8")).hexdigest()
+    return f"{conversation_id}:{digest}"
+
+
+# Function to run an email through the pipeline at most once per idempotency key. Concurrent
+# duplicates wait for the first execution and replays within the window get its response.
+def handle_email(conversation_id, html_content, policy_lookup=None, idempotency_key=None, conversation_writer=None):
+    # Every log record written while this email is processed carries its conversation ID
+    token = conversation_id_var.set(conversation_id)
+    try:
+        key = idempotency_key or make_idempotency_key(conversation_id, html_content)
+        cached = idempotency_cache.get(key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        result, status_code = request_flight.do(key, process_email, conversation_id, html_content, policy_lookup,
+                                                conversation_writer)
+        action = result.get("action") or ("Error" if "error" in result else "Failed")
+        metrics.request_duration.observe(time.perf_counter() - start, action=action)
+        metrics.requests_total.inc(action=action, status=status_code)
+
+        # Server errors are not cached so that a retry runs the pipeline again
+        if status_code < 500:
+            idempotency_cache.set(key, (result, status_code))
+        return result, status_code
+    finally:
+        conversation_id_var.reset(token)
+
+
+# Function to convert the HTML email content to plain text
+@timed("clean_html")
+def clean_email_html(html_content):
+    text = html_to_text(html_content, keep_lines=True)
+
+    # Only the new content of the email, and the quoted lines extraction needs, is kept
+    trimmed_text, removed_chars = trim_email(text)
+    if removed_chars:
+        logger.debug("Trimmed %d of %d characters of quoted history and boilerplate", removed_chars, len(text))
+    return re.sub(r'\s+', ' ', trimmed_text).strip()
+
+
+# Function to run one email through the claim intake pipeline.
+# Returns the response JSON as a dict together with the HTTP status code.
+def process_email(conversation_id, html_content, policy_lookup=None, conversation_writer=None):
+    policy_lookup = policy_lookup or fetch_policy_details
+    conversation_writer = conversation_writer or store_conversation
+    try:
+        cleaned_text = clean_email_html(html_content)
+
+        # Existence check and stored state of the conversation in a single query
+        state = get_conversation_state(conversation_id)
+
+        if state is None:
+
+            # Extract policy number and loss date using Gen AI, then fetch the policy details
+            # from PolicyCenter and the claim history from ClaimCenter in parallel.
+            # In single call mode the same Gen AI call also returns the intent and a claim draft.
+            claim_draft = None
+            if PIPELINE_MODE == "single_call":
+                policy_number, loss_date, intent, claim_draft = extract_claim_draft(cleaned_text)
+                if intent == "SystemMessage":
+                    return {
+                        "message": "No claim action required for this email",
+                        "action": "NotRequired"
+                    }, 200
+            else:
+                policy_number, loss_date = extract_policy_fields(cleaned_text)
+            if policy_number is None:
+                return {
                     "claimNumber": None,
-                    "policyNumber": policy_number,
+                    "policyNumber": None,
                     "message": "Policy Number is Invalid or Policy Does Not Exist",
                     "action": "InvalidPolicy"
-                }), 200
-            
-            # Function to verify if the policy is expired or not using the policy details
-            policy_status = verify_policy(policy_details, loss_date)
-            print(f"[DEBUG] Policy Status: {policy_status}")
-            if policy_status =="PolicyInvalid":
-                return jsonify({
-                    "claimNumber": None,
-                    "policyNumber": policy_number,
-                    "message": "Policy is Expired or Invalid",
-                    "action": "PolicyExpired"
-                }), 200
-            elif policy_status == "Not Eligible":
-                return jsonify({
-                    "claimNumber": None,
-                    "policyNumber": policy_number,
-                    "message": "Policy is Not Eligible for Claim",
-                    "action": "NotEligible"
-                }), 200
-            
-            
-            # Function to check if duplicate claim exists using Gen AI
-            # Uncommenqt the below line and comment the next line to use the old duplicate claim validation function
-            # which uses Gen AI to validate duplicate claims
-
-            # result = validate_Duplicate_Claim(policy_number, cleaned_text)
-            
-            result = validate_claim(policy_number, loss_date)
-            
-            if result is None or result.get("Status") == "New":
-                return attempt_claim_creation(cleaned_text, policy_details, policy_number)
-
-            elif result.get("Status") == "Duplicate":
-                store_conversation(conversation_id, cleaned_text)
-                return jsonify({
-                    "policyNumber": result.get("PolicyNumber"),
-                    "claimNumber": result.get("ClaimNumber"),
-                    "lossDate": result.get("LossDate"),
-                    "claimStatus": result.get("ClaimStatus"),
-                    "message": "Duplicate Claim Found",
-                    "action": "DuplicateClaim"
-                }), 200
+                }, 200
+
+            # Two emails for the same loss arriving together must not both pass the duplicate check
+            response, status_code, duplicate_state = claim_flight.do(
+                (policy_number, loss_date), process_new_claim,
+                cleaned_text, policy_number, loss_date, policy_lookup, claim_draft
+            )
+            # Every conversation that got the duplicate answer is stored, so its follow-up is recognised
+            if duplicate_state is not None:
+                conversation_writer(conversation_id, cleaned_text, policy_number, loss_date, **duplicate_state)
+            return response, status_code
 
         # Follow-up email in an existing conversation
         else:
 
-            # Uncomment below lines to use Gen AI to determine email intent
-            # email_intent = get_email_intent(cleaned_text)
-            # print(f"[DEBUG] Email Intent: {email_intent}")
-            # if email_intent == "Proceed":
-            
-            if "proceed" in cleaned_text.lower():
-                body = get_conversation_body(conversation_id)
-                print("[DEBUG] Retrieved body for FollowUp:", body)
+            # Classified locally, Gen AI is only asked when the local classifier is unsure
+            with span("intent"):
+                email_intent, confidence, source = classify_intent(cleaned_text)
+            logger.debug("Email intent %s (confidence %.2f, %s)", email_intent, confidence, source)
+
+            if email_intent == "Proceed":
+                body = state["body"]
+                logger.debug("Retrieved body for follow-up, %d characters", len(body or ""))
                 if body:
-                    policy_details, policy_number, loss_date = extract_policy_details(body)
+                    # Resume from the extraction results stored with the conversation when available
+                    if state["policy_number"] and state["loss_date"]:
+                        policy_number, loss_date = state["policy_number"], state["loss_date"]
+                    else:
+                        policy_number, loss_date = extract_policy_fields(body)
+                    policy_details = policy_lookup(policy_number) if policy_number else None
                     if policy_details is None:
-                        return jsonify({
+                        return {
                             "claimNumber": None,
                             "policyNumber": policy_number,
                             "message": "Policy Number is Invalid or Policy Does Not Exist",
                             "action": "InvalidPolicy"
-                        }), 200
+                        }, 200
                     
-                    policy_status = verify_policy(policy_details, loss_date)
+                    policy_status = state["policy_status"]
+                    if policy_status is None:
+                        policy_snapshot = parse_policy(policy_details)
+                        policy_status = verify_policy(policy_snapshot, loss_date)
                     if policy_status =="PolicyInvalid":
-                        return jsonify({
+                        return {
                             "claimNumber": None,
                             "policyNumber": policy_number,
                             "message": "Policy is Expired or Invalid",
                             "action": "PolicyExpired"
-                        }), 200
+                        }, 200
                     elif policy_status == "Not Eligible":
-                        return jsonify({
+                        return {
                             "claimNumber": None,
                             "policyNumber": policy_number,
                             "message": "Policy is Not Eligible for Claim",
                             "action": "NotEligible"
-                        }), 200
+                        }, 200
                     
-                    return attempt_claim_creation(body, policy_details, policy_number)
+                    return attempt_claim_creation(body, policy_details, policy_number, loss_date,
+                                                  fnol_payload=state["fnol_payload"], conversation_id=conversation_id)
 
-            return jsonify({
+            return {
                 "message": "No claim action required for this email",
                 "action": "NotRequired"
-            }), 200
+            }, 200
 
     except Exception as e:
-        return jsonify({
+        logger.exception("Claim processing failed")
+        return {
             "error": "Exception occurred during claim creation",
             "message": str(e),
             "policyNumber": policy_number if 'policy_number' in locals() else None
-        }), 500
+        }, 500
+
+
+# Function to run the new claim part of the pipeline once the policy number and loss date are known.
+# Concurrent emails for the same policy and loss date share a single execution, so the conversation
+# is not stored here: along with the response and status code it returns the conversation fields
+# each caller stores for a duplicate claim, or None.
+def process_new_claim(cleaned_text, policy_number, loss_date, policy_lookup, claim_draft=None):
+    policy_future = submit_with_context(intake_executor, policy_lookup, policy_number)
+    claim_future = submit_with_context(intake_executor, validate_claim, policy_number, loss_date)
+
+    policy_details = policy_future.result()
+    if policy_details is None:
+        claim_future.cancel()
+        return {
+            "claimNumber": None,
+            "policyNumber": policy_number,
+            "message": "Policy Number is Invalid or Policy Does Not Exist",
+            "action": "InvalidPolicy"
+        }, 200, None
+    
+    # Parse the policy once and reuse the snapshot for every check
+    policy_snapshot = parse_policy(policy_details)
+
+    # Function to verify if the policy is expired or not using the policy details
+    policy_status = verify_policy(policy_snapshot, loss_date)
+    logger.debug("Policy status: %s", policy_status)
+    if policy_status in ("PolicyInvalid", "Not Eligible"):
+        # The claim lookup result is not needed for an invalid policy
+        claim_future.cancel()
+
+    if policy_status =="PolicyInvalid":
+        return {
+            "claimNumber": None,
+            "policyNumber": policy_number,
+            "message": "Policy is Expired or Invalid",
+            "action": "PolicyExpired"
+        }, 200, None
+    elif policy_status == "Not Eligible":
+        return {
+            "claimNumber": None,
+            "policyNumber": policy_number,
+            "message": "Policy is Not Eligible for Claim",
+            "action": "NotEligible"
+        }, 200, None
+    
+    
+    # Function to check if duplicate claim exists using Gen AI
+    # Uncommenqt the below line and comment the next line to use the old duplicate claim validation function
+    # which uses Gen AI to validate duplicate claims
+
+    # result = validate_Duplicate_Claim(policy_number, cleaned_text)
+    
+    result = claim_future.result()
+    
+    if result is None or result.get("Status") == "New":
+        # A draft from the single call extraction only needs the policy dependent fields filled in
+        fnol_payload = None
+        if claim_draft is not None:
+            fnol_payload = complete_fnol_payload(claim_draft, policy_snapshot, policy_number, loss_date)
+        response, status_code = attempt_claim_creation(cleaned_text, policy_details, policy_number, loss_date,
+                                                       fnol_payload=fnol_payload, policy_snapshot=policy_snapshot)
+        return response, status_code, None
+
+    elif result.get("Status") == "Duplicate":
+        return {
+            "policyNumber": result.get("PolicyNumber"),
+            "claimNumber": result.get("ClaimNumber"),
+            "lossDate": result.get("LossDate"),
+            "claimStatus": result.get("ClaimStatus"),
+            "message": "Duplicate Claim Found",
+            "action": "DuplicateClaim"
+        }, 200, {"policy_status": policy_status, "duplicate_result": result}
+
+
+@app.route("/onPrem/v2/policyCache/<policy_number>", methods=["DELETE"])
+def delete_policy_cache(policy_number):
+    removed = invalidate_policy(policy_number)
+    return jsonify({
+        "policyNumber": policy_number,
+        "invalidated": removed
+    }), 200
+
+
+@app.route("/onPrem/v2/storageReport", methods=["GET"])
+def storage_report():
+    return jsonify(get_storage_report()), 200
 
 
-def attempt_claim_creation(cleaned_text, policy_details, policy_number):
-    """Helper to retry claim creation up to 3 times."""
+@app.route("/onPrem/v2/aiRateLimit", methods=["GET"])
+def ai_rate_limit():
+    return jsonify(gemini_limiter.stats()), 200
+
+
+# Readiness probe: fails while the server drains for shutdown, or when the database can not be read
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    if shutting_down.is_set():
+        return jsonify({"status": "draining"}), 503
+    try:
+        get_connection().execute("SELECT 1").fetchone()
+    except sqlite3.Error as e:
+        return jsonify({"status": "unavailable", "message": str(e)}), 503
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def attempt_claim_creation(cleaned_text, policy_details, policy_number, loss_date=None, fnol_payload=None,
+                           conversation_id=None, policy_snapshot=None):
+    """Helper to retry claim creation up to 3 times, regenerating the payload only when it is invalid."""
     claim_number = None
-    for attempt in range(3):
-        response_payload = generate_response(cleaned_text, policy_details)
-        createClaimResponse = createClaim(response_payload)
+    createClaimResponse = None
+    response_payload = None
+    payload = fnol_payload
+    regenerate = False
+    rejected = False
+    for attempt in range(FNOL_MAX_ATTEMPTS):
+        if payload is None:
+            if regenerate:
+                payload = generate_response(cleaned_text, policy_details, policy_snapshot, use_cache=False,
+                                            temperature=FNOL_REGENERATE_TEMPERATURE)
+            else:
+                payload = generate_response(cleaned_text, policy_details, policy_snapshot)
+
+        # A payload that can not pass the template and master data checks is never sent
+        errors = validate_fnol_payload(payload)
+        if errors:
+            logger.warning("FNOL payload failed validation: %s", errors)
+            metrics.fnol_retries.inc(reason="invalid_payload")
+            payload = None
+            regenerate = True
+            continue
+        response_payload = payload
+
+        try:
+            createClaimResponse = createClaim(response_payload)
+        except requests.exceptions.RequestException as e:
+            logger.error("createFNOL request failed: %s", e)
+            createClaimResponse = None
 
-        if createClaimResponse.status_code in [200, 201]:
+        if createClaimResponse is None:
+            metrics.fnol_attempts.inc(outcome="unreachable")
+        else:
+            metrics.fnol_attempts.inc(outcome=f"{createClaimResponse.status_code // 100}xx")
+
+        if createClaimResponse is not None and createClaimResponse.status_code in [200, 201]:
             response_json = createClaimResponse.json()
             claim_number = response_json.get("claimNumber", "N/A")
-            return jsonify({
+
+            # Record the new claim locally so a repeat email is caught as a duplicate right away
+            if loss_date and claim_number != "N/A":
+                claim_index.add_claim(policy_number, claim_number, loss_date,
+                                      policy_type=response_payload.get("PolicyType"))
+
+            return {
                 "claimNumber": claim_number,
                 "policyNumber": policy_number,
                 "message": "Claim Created Successfully",
                 "action": "ClaimCreated"
-            }), 200
+            }, 200
+
+        status_code = createClaimResponse.status_code if createClaimResponse is not None else None
+        rejected = status_code is not None and 400 <= status_code < 500 and status_code not in FNOL_TRANSIENT_STATUS_CODES
+        if rejected:
+            # ClaimCenter rejected the payload itself, ask Gen AI for a new one
+            metrics.fnol_retries.inc(reason="rejected")
+            payload = None
+            regenerate = True
+        elif attempt < FNOL_MAX_ATTEMPTS - 1:
+            metrics.fnol_retries.inc(reason="transient")
+            delay = FNOL_RETRY_BASE_DELAY * (2 ** attempt) + random.uniform(0, 1)
+            logger.warning("createFNOL failed with status %s, retrying in %.2f seconds", status_code, delay)
+            time.sleep(delay)
+
+    # Keep the last payload so the next follow-up does not have to generate it again, unless
+    # ClaimCenter rejected it: then the follow-up starts from a new one
+    if conversation_id is not None and response_payload is not None:
+        store_fnol_payload(conversation_id, None if rejected else response_payload)
+
+    if createClaimResponse is not None:
+        status_code = createClaimResponse.status_code
+    else:
+        # No request reached ClaimCenter: every payload was invalid, or the service was unreachable
+        status_code = 422 if response_payload is None else 502
 
-    return jsonify({
+    return {
         "claimNumber": claim_number,
         "policyNumber": policy_number,
         "message": "Failed"
-    }), createClaimResponse.status_code
+    }, status_code
 
 
-def generate_response(user_input, policy_details):
+@timed("generate_response")
+def generate_response(user_input, policy_details, policy_snapshot=None, use_cache=True, temperature=0.0):
     # Load claim template
-    with open('claim_template.json', 'r') as f:
-        claim_template = json.load(f)
+    claim_template = load_claim_template()
+
+    # Only the policy fields the prompt needs are sent, as compact JSON instead of the raw XML
+    policy_context, raw_tokens, context_tokens = build_policy_context(policy_details, policy_snapshot)
+    if raw_tokens is not None:
+        logger.debug("Policy context: %d tokens instead of %d", context_tokens, raw_tokens)
 
     prompt = f"""
 You are a professional insurance claim assistant.
@@ -182,57 +604,7 @@ Your job is to extract structured data from the user's claim description and pop
 
 Master Data (use ONLY these values exactly):
 
-ClaimantType:
-- insured
-- householdmember
-- propertyowner
-- customer
-- employee
-- other
-
-PolicyType:
-- BusinessOwners
-- BusinessAuto
-- CommercialPackage
-- CommercialProperty
-- farmowners
-- GeneralLiability
-- HOPHomeowners
-- InlandMarine
-- PersonalAuto
-- travel_per
-- PersonalUmbrella
-- prof_liability
-- WorkersComp
-- D and 0
-
-RelationshipToInsured:
-- self
-- agent
-- attorney
-- employee
-- claimant
-- claimantatty
-- rentalrep
-- repairshop
-- other
-
-LossCause:
-- animal_bite
-- burglary
-- earthquake
-- explosion
-- fire
-- glassbreakage
-- hail
-- hurricane
-- vandalism
-- mold
-- riotandcivil
-- snowice
-- structfailure
-- waterdamage
-- wind
+{format_master_data()}
 
 ---
 
@@ -285,7 +657,7 @@ Claim Information:
 {user_input}
 
 Policy Details:
-{policy_details}
+{policy_context}
 
 ---
 
@@ -293,8 +665,12 @@ Fill out the below template using only values inferred from the above:
 {claim_template}
 """
 
-    
-    response = get_ai_content(prompt)
+    # A regeneration means the payload generated before was invalid or rejected, it is dropped from the cache
+    if not use_cache:
+        invalidate_ai_content(prompt, response_schema=claim_response_schema())
+
+    response = get_ai_content(prompt, temperature=temperature, use_cache=use_cache,
+                              response_schema=claim_response_schema())
 
     if not response:
         raise ValueError("Failed to get a valid response from the AI.")
@@ -302,86 +678,217 @@ Fill out the below template using only values inferred from the above:
     # Extract JSON from the AI response
     extracted_json = extract_json_from_response(response)
 
-    
+    # An unusable payload is not kept in the prompt cache, the next email gets a fresh one
+    if validate_fnol_payload(extracted_json):
+        invalidate_ai_content(prompt, temperature=temperature, response_schema=claim_response_schema())
+
     return extracted_json
 
 
+CLAIM_DRAFT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "PolicyNumber": {"type": "STRING"},
+        "LossDate": {"type": "STRING"},
+        "Intent": {"type": "STRING", "format": "enum", "enum": ["NewClaim", "SystemMessage"]},
+        "Claim": claim_response_schema(),
+    },
+    "required": ["PolicyNumber", "LossDate", "Intent"],
+}
+
+
+# Function to get the policy fields, the intent and a claim draft from a new email in one Gen AI call.
+# The draft is made without the policy details; complete_fnol_payload fills in the policy dependent fields.
+def extract_claim_draft(text):
+    prompt = f"""
+You are a professional insurance claim assistant.
+
+From the email below, return a JSON object with these keys:
+- "PolicyNumber": the policy number, digits only.
+- "LossDate": the date and time of the loss in ISO 8601 with timezone offset, like "2024-06-19T00:00:00+05:30".
+- "Intent": "SystemMessage" if the email is clearly an automated message from the company/system
+  (claim registration confirmation, status update, disclaimer), otherwise "NewClaim".
+- "Claim": the claim template below filled with values inferred from the email only.
+
+Master Data (use ONLY these values exactly):
+
+{format_master_data()}
+
+Rules for "Claim":
+1. Leave fields blank or omit them entirely if data is missing or uncertain.
+2. For `InvolvedVehicles`, add only if vehicle info (like VIN or plate) is present.
+3. For `InvolvedCoverage`, set `Coverage` from the incident description (e.g., "rear-ended" = Collision),
+   with the claimant names and `ClaimantType`. Leave `CoverageType` and `CoverageSubtype` blank.
+4. `RelationshipToInsured` is based on who is reporting (e.g., "I", "my friend").
+5. `LossCause` from the incident nature, glassbreakage when it is not mentioned.
+6. Loss occured should be a string value, eg "Home"/"At Premises"/"At Work"/ "At Street"
+
+Return only the JSON object. No explanation text. Do not hallucinate missing details.
+
+Email:
+{text}
+
+Claim template:
+{load_claim_template()}
+"""
+
+    # Values the rules read with high confidence win over the model output
+    with span("extract_fast_path"):
+        fast_policy_number, fast_loss_date = try_fast_path(text)
+
+    with span("extract_llm"):
+        response = get_ai_content(prompt, response_schema=CLAIM_DRAFT_SCHEMA)
+    draft = extract_json_from_response(response or "")
+    if not isinstance(draft, dict):
+        draft = {}
+
+    policy_number = str(draft.get("PolicyNumber") or "").strip() or None
+    if policy_number is not None and not policy_number.isdigit():
+        policy_number = None
+    loss_date = valid_loss_date(draft.get("LossDate"))
+
+    if fast_policy_number is not None:
+        policy_number, loss_date = fast_policy_number, fast_loss_date
+    elif policy_number is None or loss_date is None:
+        # No usable draft fields, extract them the staged way
+        policy_number, loss_date = extract_policy_fields(text, fast_path=False)
+
+    claim = draft.get("Claim")
+    return policy_number, loss_date, draft.get("Intent"), claim if isinstance(claim, dict) else None
+
+
+# Function to check a loss date returned by Gen AI is an ISO 8601 date. Returns it, or None.
+def valid_loss_date(value):
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return value.strip()
+
+
 def extract_json_from_response(response_data):
-    match = re.search(r'```json\n(.*?)\n```', response_data, re.DOTALL)
-    if match:
-        json_str = match.group(1)
-        try:
-            json_obj = json.loads(json_str)
-            return json_obj
-        except json.JSONDecodeError as e:
-            print("Invalid JSON:", e)
-    else:
-        print("No JSON block found.")
-    return None
+    json_obj = parse_json_response(response_data)
+    if json_obj is None:
+        logger.warning("No JSON found in the AI response.")
+    return json_obj
 
 
 # Method to create claim by calling the claim creation API
+@timed("create_fnol")
 def createClaim(response):
 
-    url = "http://18.218.57.115:8090/cc/rest/fnol/v1/createFNOL"
-
     payload = json.dumps(response)
 
-    headers = {
-      'Content-Type': 'application/json',
-      'Authorization': 'Basic c3U6Z3c='
-    }
-
-    response = requests.request("POST", url, headers=headers, data=payload)
+    response = guidewire.post("createFNOL", payload)
 
     
     return response
 
-# Function to call the policy details API and extract the policy number and loss date using Gen AI
-def extract_policy_details(text):
+# Function to extract the policy number and loss date from the email text, using Gen AI when the rules are not confident
+def extract_policy_fields(text, fast_path=True):
+    # Try the rule based extraction first, Gen AI is only called when its confidence is low
+    if fast_path:
+        with span("extract_fast_path"):
+            policy_number, loss_date = try_fast_path(text)
+        if policy_number is not None:
+            return policy_number, loss_date
+
     # Prompt AI to extract the policy number
     prompt = f"""From the following text, extract the policy details in text format. Eg: "PolicyNumber": "12312312", "LossDate":"2025-07-22T22:30:00.000Z". Do not return anything else.\n\n{text}"""
-    policy = get_ai_content(prompt)
+    with span("extract_llm"):
+        policy = get_ai_content(prompt)
 
-    
+    if not policy:
+        return None, None
 
     # Extract policy number using regex
     match = re.search(r'"PolicyNumber":\s*"(\d+)"', policy)
     if not match:
-        
-        return None
+        return None, None
 
     policy_number = match.group(1)
-    
 
     # Extract loss date using regex
     match_loss_date = re.search(r'"LossDate":\s*"([\d\-T:\.Z]+)"', policy)
     if not match_loss_date:
-    
-        return None
+        return None, None
 
-    loss_date = match_loss_date.group(1)
+    loss_date = valid_loss_date(match_loss_date.group(1))
+    if loss_date is None:
+        return None, None
 
-    # Prepare API request
-    url = "http://18.218.57.115:8190/pc/rest/policy/v1/latestDetailsBasedOnAccOrPocNo"
-    headers = {
-        'Content-Type': 'text/plain',
-        'Authorization': 'Basic c3U6Z3c='
-    }
+    return policy_number, loss_date
+
+
+# Function to call the policy details API for the given policy number, served from the policy cache when possible
+@timed("policy_fetch")
+def fetch_policy_details(policy_number, use_cache=True):
+    if use_cache:
+        cached = policy_cache.get(policy_number)
+        if cached is not None:
+            return None if cached == POLICY_NOT_FOUND else cached
 
     payload = f"{policy_number}\r\n"
 
     # Send request
     try:
-        response = requests.post(url, headers=headers, data=payload)
+        response = guidewire.post("latestDetailsBasedOnAccOrPocNo", payload)
         response.raise_for_status()  # Raises an exception for HTTP 4xx/5xx
 
-       
-        return response.text,policy_number,loss_date
+    except requests.exceptions.HTTPError as e:
+        # A 4xx means PolicyCenter does not know the policy, remember that for a shorter time
+        if e.response is not None and 400 <= e.response.status_code < 500:
+            policy_cache.set(policy_number, POLICY_NOT_FOUND, ttl=POLICY_CACHE_NEGATIVE_TTL)
+        return None
 
     except requests.exceptions.RequestException as e:
         
-        return None, policy_number,loss_date
+        return None
+
+    policy_details = response.text
+    if not policy_details.strip() or policy_details.strip() == "[]":
+        policy_cache.set(policy_number, POLICY_NOT_FOUND, ttl=POLICY_CACHE_NEGATIVE_TTL)
+        return None
 
+    policy_cache.set(policy_number, policy_details)
+    return policy_details
+
+
+# Function to drop a policy from the policy cache, e.g. after it was changed in PolicyCenter
+def invalidate_policy(policy_number):
+    return policy_cache.invalidate(policy_number)
+
+
+# Function to call the policy details API and extract the policy number and loss date using Gen AI
+def extract_policy_details(text):
+    policy_number, loss_date = extract_policy_fields(text)
+    if policy_number is None:
+        return None, None, None
+
+    return fetch_policy_details(policy_number), policy_number, loss_date
+
+
+# Component statistics exposed on /metrics next to the pipeline metrics
+metrics.registry.gauge_callback("policy_cache", "Policy cache statistics", policy_cache.stats, "field")
+metrics.registry.gauge_callback("idempotency_cache", "Idempotency cache statistics", idempotency_cache.stats, "field")
+metrics.registry.gauge_callback("ai_prompt_cache", "Gen AI prompt cache statistics", prompt_cache.stats, "field")
+metrics.registry.gauge_callback("gemini_rate_limiter", "Gemini rate limiter statistics, queue wait in seconds",
+                                gemini_limiter.stats, "field")
+metrics.registry.gauge_callback("fast_extract", "Rule based extraction statistics", extractor_stats, "field")
+metrics.registry.gauge_callback("policy_context", "Policy context token statistics", context_stats, "field")
+metrics.registry.gauge_callback("ai_json_parse", "Gen AI JSON response parsing statistics", parse_stats, "field")
+metrics.registry.gauge_callback("email_trim", "Email trimming statistics", trim_stats, "field")
+metrics.registry.gauge_callback("email_intent", "Follow-up email intent classification statistics", intent_stats,
+                                "field")
+metrics.registry.gauge_callback("single_flight_shared", "Calls served by an execution already in flight",
+                                lambda: {"request": request_flight.shared, "claim": claim_flight.shared}, "flight")
+
+# Background workers for createClaim requests submitted in async mode
+init_job_db()
+start_job_workers(handle_email)
+
+# Development server only, use serve.py in production
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=os.getenv("flask_debug", "false").lower() == "true", host='0.0.0.0', port=5000)
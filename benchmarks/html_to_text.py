@@ -0,0 +1,98 @@
+"""Micro-benchmark of the email HTML to text stage.
+
+Compares htmltext.html_to_text with the previous BeautifulSoup html.parser path on
+synthetic bodies shaped like the emails the intake receives.
+
+    python benchmarks/html_to_text.py [--repeat N]
+"""
+import argparse
+import base64
+import html
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from htmltext import html_to_text
+
+
+def beautifulsoup_to_text(html_content):
+    soup = BeautifulSoup(html_content, "html.parser")
+    plain_text = soup.get_text(separator=" ")
+    decoded_text = html.unescape(plain_text)
+    cleaned_text = re.sub(r'(\\n|/n|\n|\r)', ' ', decoded_text)
+    return re.sub(r'\s+', ' ', cleaned_text).strip()
+
+
+CLAIM_TEXT = (
+    "Hello, I would like to report a claim. My policy number is 1234567 and the loss happened on "
+    "July 22, 2025 at 10:30 PM. My car was rear-ended at a traffic light on Main Street, the rear "
+    "bumper and trunk are damaged. VIN 1HGCM82633A004352. Please let me know the next steps."
+)
+
+
+def plain_email():
+    return f"<html><body><p>{CLAIM_TEXT}</p><p>Thanks,<br>John Smith</p></body></html>"
+
+
+def outlook_email():
+    style = "font-family:Calibri,sans-serif;font-size:11pt;color:#1F497D;mso-fareast-language:EN-US"
+    css = "".join(f".MsoStyle{i} {{margin:0in;{style}}}\n" for i in range(300))
+    words = "".join(f'<span style="{style}">{word} </span>' for word in CLAIM_TEXT.split())
+    return (f"<html><head><style>{css}</style></head><body><div class=WordSection1>"
+            f"<p class=MsoNormal>{words}</p></div></body></html>")
+
+
+def reply_chain_email(depth=15):
+    body = plain_email()
+    for i in range(depth):
+        body = (f"<div><p>Reply {i}: thank you, we are looking into it.</p><hr>"
+                f"<p><b>From:</b> Claims Desk &lt;claims@example.com&gt;<br><b>Sent:</b> Monday</p>"
+                f"<blockquote>{body}</blockquote></div>")
+    return body
+
+
+def inline_image_email():
+    image = base64.b64encode(random.Random(1).randbytes(400 * 1024)).decode()
+    return (f"<html><body><p>{CLAIM_TEXT}</p>"
+            f'<img src="data:image/png;base64,{image}" alt="damage"></body></html>')
+
+
+def signature_email():
+    rows = "".join(
+        f'<tr><td style="padding:0;border:none"><a href="https://example.com/{i}">Link {i}</a></td>'
+        f'<td>&nbsp;|&nbsp;</td><td>Disclaimer line {i}: this message is confidential.</td></tr>'
+        for i in range(400)
+    )
+    return (f"<html><body><p>{CLAIM_TEXT}</p><script>var tracking = {{id: 1}};</script>"
+            f"<table>{rows}</table></body></html>")
+
+
+CORPUS = {
+    "plain": plain_email(),
+    "outlook_styles": outlook_email(),
+    "reply_chain": reply_chain_email(),
+    "inline_image": inline_image_email(),
+    "long_signature": signature_email(),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'email':<16}{'size KB':>10}{'bs4 ms':>10}{'htmltext ms':>13}{'speedup':>9}  same text")
+    for name, body in CORPUS.items():
+        old = min(timeit.repeat(lambda: beautifulsoup_to_text(body), number=1, repeat=args.repeat)) * 1000
+        new = min(timeit.repeat(lambda: html_to_text(body), number=1, repeat=args.repeat)) * 1000
+        same = beautifulsoup_to_text(body) == html_to_text(body)
+        print(f"{name:<16}{len(body) / 1024:>10.0f}{old:>10.2f}{new:>13.2f}{old / new:>8.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
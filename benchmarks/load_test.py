@@ -0,0 +1,385 @@
+"""End-to-end load test of /onPrem/v2/createClaim against local stand-ins.
+
+Starts stub PolicyCenter/ClaimCenter endpoints (latestDetailsBasedOnAccOrPocNo,
+getClaimDetails, createFNOL) and a fake Gemini backend, all with configurable
+latency and error rates, runs the service in-process on a local port and drives
+it at a fixed concurrency with new-claim, duplicate and follow-up emails.
+Reports throughput and p50/p95/p99 latency per scenario.
+
+    python benchmarks/load_test.py --concurrency 16 --requests 200
+    python benchmarks/load_test.py --scenarios new_claim --ai-latency 1500 --ai-error-rate 0.05 --json
+
+The service runs in a temporary working directory, so its SQLite databases and
+caches start empty and the ones in the repository are not touched.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ("new_claim", "duplicate", "follow_up")
+
+POLICY_XML = (
+    '<PolicyPeriod xmlns="http://guidewire.com/pc/gx/gw.webservice.pc.pc1000.gxmodel.policyperiodmodel">'
+    "<PeriodEnd>{end}</PeriodEnd><PolicyNumber>{number}</PolicyNumber>"
+    "<Policy><OriginalEffectiveDate>{start}</OriginalEffectiveDate><ProductCode>PersonalAuto</ProductCode></Policy>"
+    "<PersonalAutoLine><PolicyType>PersonalAuto</PolicyType><PALineCoverages>"
+    "<Entry><PublicID>pc:101</PublicID><PatternCode>PACollisionCov</PatternCode><DisplayName>Collision</DisplayName></Entry>"
+    "<Entry><PublicID>pc:102</PublicID><PatternCode>PAComprehensiveCov</PatternCode><DisplayName>Comprehensive</DisplayName></Entry>"
+    "</PALineCoverages><Vehicles><Entry><Vin>1HGCM82633A004352</Vin><Make>Honda</Make></Entry></Vehicles>"
+    "</PersonalAutoLine><PolicyAddress><AddressLine1>1 Main St</AddressLine1><City>Springfield</City>"
+    "<State>IL</State><PostalCode>62701</PostalCode></PolicyAddress></PolicyPeriod>"
+)
+
+
+# Latency with a log-normal spread around the median, as remote calls usually have a long tail
+def sample_delay(median_ms, jitter):
+    if median_ms <= 0:
+        return 0.0
+    return median_ms / 1000.0 * math.exp(random.gauss(0, jitter))
+
+
+class Backend:
+    """State shared by the stub servers and the fake Gemini backend."""
+
+    def __init__(self, args):
+        self.args = args
+        self.claims = {}
+        self.loss_dates = {}
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.claim_counter = 0
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def add_claim(self, policy_number, loss_date):
+        with self.lock:
+            self.claim_counter += 1
+            claim_number = f"000-00-{self.claim_counter:06d}"
+            self.claims.setdefault(policy_number, []).append({
+                "ClaimNumber": claim_number,
+                "PolicyNumber": policy_number,
+                "LossDate": loss_date,
+                "PolicyType": "PersonalAuto",
+                "ClaimStatus": "Open",
+                "Exposures": [{"CreateDate": datetime.now(timezone.utc).isoformat()}],
+            })
+        return claim_number
+
+
+def make_stub_handler(backend):
+    args = backend.args
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *a):
+            pass
+
+        def reply(self, code, body):
+            data = body.encode()
+            self.send_response(code)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+
+            if self.path.endswith("latestDetailsBasedOnAccOrPocNo"):
+                backend.count("latestDetailsBasedOnAccOrPocNo")
+                time.sleep(sample_delay(args.pc_latency, args.jitter))
+                if random.random() < args.pc_error_rate:
+                    return self.reply(503, "Service Unavailable")
+                number = body.strip()
+                xml = POLICY_XML.format(number=number, start="2024-01-01T00:00:00Z", end="2027-12-31T00:00:00Z")
+                return self.reply(200, json.dumps([xml]))
+
+            if self.path.endswith("getClaimDetails"):
+                backend.count("getClaimDetails")
+                time.sleep(sample_delay(args.cc_latency, args.jitter))
+                if random.random() < args.cc_error_rate:
+                    return self.reply(503, "Service Unavailable")
+                policy_number = json.loads(body).get("PolicyNumber")
+                with backend.lock:
+                    claims = list(backend.claims.get(policy_number, []))
+                return self.reply(200, json.dumps(claims))
+
+            if self.path.endswith("createFNOL"):
+                backend.count("createFNOL")
+                time.sleep(sample_delay(args.fnol_latency, args.jitter))
+                if random.random() < args.fnol_error_rate:
+                    return self.reply(503, "Service Unavailable")
+                payload = json.loads(body)
+                claim_number = backend.add_claim(payload.get("PolicyNumber"), payload.get("LossDate"))
+                return self.reply(201, json.dumps({"claimNumber": claim_number}))
+
+            self.reply(404, "Not Found")
+
+    return StubHandler
+
+
+def make_fake_generate_content(backend):
+    args = backend.args
+
+    def policy_number_in(text):
+        match = re.search(r"\b(\d{7})\b", text)
+        return match.group(1) if match else None
+
+    def claim_payload(policy_number):
+        return {
+            "PolicyNumber": policy_number,
+            "LossDate": backend.loss_dates.get(policy_number, ""),
+            "PolicyType": "PersonalAuto",
+            "InvolvedVehicles": [{
+                "Vin": "1HGCM82633A004352",
+                "LossOccured": "At Street",
+                "InvolvedCoverage": [{"Coverage": "Collision", "CoverageType": "PACollisionCov",
+                                      "CoverageSubtype": "PACollisionCov", "ClaimantType": "insured"}],
+            }],
+            "RelationshipToInsured": "self",
+            "LossCause": "glassbreakage",
+        }
+
+    def answer(prompt):
+        if "extract the policy details" in prompt:
+            number = policy_number_in(prompt)
+            return f'"PolicyNumber": "{number}", "LossDate":"{backend.loss_dates.get(number, "")}"'
+        if '"Intent"' in prompt:
+            number = policy_number_in(prompt.split("Email:", 1)[-1])
+            return json.dumps({"PolicyNumber": number, "LossDate": backend.loss_dates.get(number),
+                               "Intent": "NewClaim", "Claim": claim_payload(number)})
+        if "Fill out the below template" in prompt:
+            number = policy_number_in(prompt.split("Policy Details:", 1)[-1])
+            return "```json\n" + json.dumps(claim_payload(number), indent=2) + "\n```"
+        return "Proceed"
+
+    def fake_generate_content(prompt, generation_config):
+        backend.count("gemini")
+        time.sleep(sample_delay(args.ai_latency, args.jitter))
+        if random.random() < args.ai_error_rate:
+            raise Exception("429 RESOURCE_EXHAUSTED: quota exceeded")
+        text = answer(prompt)
+        part = types.SimpleNamespace(text=text)
+        return types.SimpleNamespace(
+            candidates=[types.SimpleNamespace(content=types.SimpleNamespace(parts=[part]))],
+            usage_metadata=types.SimpleNamespace(total_token_count=(len(prompt) + len(text)) // 4),
+        )
+
+    return fake_generate_content
+
+
+# Emails are written two ways: with labelled fields the rule based extraction reads, and
+# unlabelled ones that need the Gen AI extraction
+def claim_email(policy_number, loss_time, labelled):
+    if labelled:
+        when = loss_time.strftime("%B %d, %Y at %I:%M %p")
+        return (f"<html><body><p>Hello,</p><p>Policy number {policy_number}. The loss date is {when}.</p>"
+                f"<p>My car was rear-ended at a traffic light, the rear bumper is damaged.</p>"
+                f"<p>Regards,</p><p>Alex</p></body></html>")
+    when = loss_time.strftime("%d %B %Y")
+    return (f"<html><body><div>Hi team, reference {policy_number} here.</div>"
+            f"<div>Someone hit my parked car, the accident happened {when} in the evening.</div>"
+            f"<div>Thanks</div></body></html>")
+
+
+class Corpus:
+
+    def __init__(self, backend, seed):
+        self.backend = backend
+        self.random = random.Random(seed)
+        self.next_policy = 3000000
+        self.conversation = 0
+
+    def new_policy(self):
+        self.next_policy += 1
+        number = str(self.next_policy)
+        loss_time = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(
+            days=self.random.randrange(0, 400), hours=self.random.randrange(8, 20))
+        self.backend.loss_dates[number] = loss_time.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        return number, loss_time
+
+    def conversation_id(self, scenario):
+        self.conversation += 1
+        return f"loadtest-{scenario}-{self.conversation}"
+
+    # Method to build the requests of a scenario, with the untimed requests that set it up
+    def build(self, scenario, count):
+        setup, timed = [], []
+        for i in range(count):
+            policy_number, loss_time = self.new_policy()
+            body = claim_email(policy_number, loss_time, labelled=i % 2 == 0)
+            conversation_id = self.conversation_id(scenario)
+
+            if scenario == "new_claim":
+                timed.append((conversation_id, body))
+
+            elif scenario == "duplicate":
+                # ClaimCenter already has a claim for this policy and loss date
+                self.backend.add_claim(policy_number, self.backend.loss_dates[policy_number])
+                timed.append((conversation_id, body))
+
+            elif scenario == "follow_up":
+                # The first email stops at the duplicate check, the reply asks to proceed
+                self.backend.add_claim(policy_number, self.backend.loss_dates[policy_number])
+                setup.append((conversation_id, body))
+                timed.append((conversation_id, "<p>Yes, please proceed with the claim.</p>"
+                                               f"<p>On Monday Claims wrote:</p><p>&gt; Possible duplicate</p>"))
+        return setup, timed
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def run_requests(url, items, concurrency):
+    local = threading.local()
+
+    def send(item):
+        conversation_id, body = item
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.post(url, data=body.encode(), timeout=300,
+                                    headers={"ConversationID": conversation_id, "Content-Type": "text/html"})
+            status = response.status_code
+            action = response.json().get("action") if response.content else None
+        except requests.exceptions.RequestException as e:
+            status, action = None, type(e).__name__
+        return time.perf_counter() - start, status, action
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, items))
+    return results, time.perf_counter() - start
+
+
+def summarize(scenario, results, elapsed):
+    latencies = [r[0] for r in results]
+    actions = {}
+    for _, status, action in results:
+        key = f"{action or 'None'}/{status}"
+        actions[key] = actions.get(key, 0) + 1
+    return {
+        "scenario": scenario,
+        "requests": len(results),
+        "errors": sum(1 for _, status, _ in results if status is None or status >= 400),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1) if latencies else 0.0,
+        "outcomes": actions,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=100, help="timed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pc-latency", type=float, default=150, help="median PolicyCenter latency in ms")
+    parser.add_argument("--cc-latency", type=float, default=100, help="median getClaimDetails latency in ms")
+    parser.add_argument("--fnol-latency", type=float, default=400, help="median createFNOL latency in ms")
+    parser.add_argument("--ai-latency", type=float, default=800, help="median Gemini latency in ms")
+    parser.add_argument("--jitter", type=float, default=0.4, help="sigma of the log-normal latency spread")
+    parser.add_argument("--pc-error-rate", type=float, default=0.0)
+    parser.add_argument("--cc-error-rate", type=float, default=0.0)
+    parser.add_argument("--fnol-error-rate", type=float, default=0.0, help="share of createFNOL calls answered 503")
+    parser.add_argument("--ai-error-rate", type=float, default=0.0, help="share of Gemini calls failing with 429")
+    parser.add_argument("--pipeline-mode", choices=("staged", "single_call"), default="staged")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the service output")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    backend = Backend(args)
+
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), make_stub_handler(backend))
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+
+    # The service reads its configuration when it is imported
+    workdir = tempfile.mkdtemp(prefix="claim-loadtest-")
+    shutil.copy(os.path.join(REPO_DIR, "claim_template.json"), workdir)
+    os.environ.update({
+        "pc_base_url": stub_url + "/pc/rest",
+        "cc_base_url": stub_url + "/cc/rest",
+        "pipeline_mode": args.pipeline_mode,
+        "fnol_retry_base_delay": os.getenv("fnol_retry_base_delay", "0.2"),
+        "job_workers": "0",
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    try:
+        import model
+        model._generate_content = make_fake_generate_content(backend)
+        import api
+        from werkzeug.serving import make_server
+
+        server = make_server("127.0.0.1", 0, api.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/onPrem/v2/createClaim"
+
+        corpus = Corpus(backend, args.seed)
+        report = []
+        for scenario in args.scenarios:
+            setup, timed = corpus.build(scenario, args.requests)
+            if setup:
+                run_requests(url, setup, args.concurrency)
+            results, elapsed = run_requests(url, timed, args.concurrency)
+            report.append(summarize(scenario, results, elapsed))
+
+        server.shutdown()
+    finally:
+        if not args.verbose:
+            sys.stdout.close()
+        sys.stdout = stdout
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"config": vars(args), "backend_calls": backend.calls, "scenarios": report}, indent=2))
+        return
+
+    print(f"concurrency={args.concurrency} pipeline_mode={args.pipeline_mode} backend calls={backend.calls}")
+    print(f"{'scenario':<12}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  outcomes")
+    for row in report:
+        print(f"{row['scenario']:<12}{row['requests']:>9}{row['errors']:>8}{row['throughput_rps']:>9}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}  {row['outcomes']}")
+
+
+if __name__ == "__main__":
+    main()
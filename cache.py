@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+# In-process LRU cache with a per-entry time to live
+class TTLCache:
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+# Two tier cache for AI responses: an in-process LRU in front of an on-disk SQLite table
+class PromptCache:
+
+    def __init__(self, db_name, maxsize=256, max_rows=10000, ttl=7 * 24 * 3600):
+        self.db_name = db_name
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_name, timeout=5)
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS prompt_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    response TEXT,
+                    created_at REAL,
+                    last_used_at REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_prompt_cache_last_used ON prompt_cache (last_used_at)')
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(model_name, generation_config, prompt):
+        config = json.dumps(generation_config, sort_keys=True, default=str)
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{model_name}|{config}|{prompt_hash}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    'SELECT response, created_at FROM prompt_cache WHERE cache_key = ?', (key,)
+                ).fetchone()
+                if row and row[1] + self.ttl >= now:
+                    conn.execute('UPDATE prompt_cache SET last_used_at = ? WHERE cache_key = ?', (now, key))
+                    conn.commit()
+                else:
+                    row = None
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error("Prompt cache read failed: %s", e)
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+
+        self.memory.set(key, row[0])
+        return row[0]
+
+    def set(self, key, response):
+        self.memory.set(key, response)
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute('''
+                    INSERT OR REPLACE INTO prompt_cache (cache_key, response, created_at, last_used_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (key, response, now, now))
+                with self._lock:
+                    self._writes += 1
+                    evict = self._writes % 100 == 0
+                if evict:
+                    self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error("Prompt cache write failed: %s", e)
+
+    def invalidate(self, key):
+        self.memory.invalidate(key)
+        try:
+            conn = self._connect()
+            try:
+                conn.execute('DELETE FROM prompt_cache WHERE cache_key = ?', (key,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error("Prompt cache delete failed: %s", e)
+
+    # Drop expired rows, then the least recently used rows above max_rows
+    def _evict(self, conn, now):
+        conn.execute('DELETE FROM prompt_cache WHERE created_at < ?', (now - self.ttl,))
+        conn.execute('''
+            DELETE FROM prompt_cache WHERE cache_key IN (
+                SELECT cache_key FROM prompt_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_rows,))
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_size": len(self.memory),
+        }
+
+
+prompt_cache = PromptCache(
+    os.getenv("ai_cache_db", "aiCache.db"),
+    maxsize=int(os.getenv("ai_cache_memory_size", "256")),
+    max_rows=int(os.getenv("ai_cache_max_rows", "10000")),
+    ttl=int(os.getenv("ai_cache_ttl", str(7 * 24 * 3600)))
+)
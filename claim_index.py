@@ -0,0 +1,133 @@
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Local claim history per policy, with loss dates kept sorted so a duplicate check is a range query.
+# A claim found here is a duplicate right away; a miss is checked against ClaimCenter, which also
+# holds the claims created by other intake nodes and channels.
+
+# Policies kept in the index, the least recently used ones are dropped first
+MAX_POLICIES = int(os.getenv("claim_index_max_policies", "10000"))
+
+
+def parse_claim_date(value):
+    date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+# Claims of one policy ordered by loss date
+class PolicyClaims:
+    __slots__ = ("loss_times", "records")
+
+    def __init__(self):
+        self.loss_times = []
+        self.records = []
+
+    def remove(self, claim_number):
+        for i, record in enumerate(self.records):
+            if record["ClaimNumber"] == claim_number:
+                del self.records[i]
+                del self.loss_times[i]
+                return
+
+    def insert(self, record):
+        self.remove(record["ClaimNumber"])
+        i = bisect.bisect_right(self.loss_times, record["LossTime"])
+        self.loss_times.insert(i, record["LossTime"])
+        self.records.insert(i, record)
+
+
+class ClaimHistoryIndex:
+
+    def __init__(self, max_policies=MAX_POLICIES):
+        self.max_policies = max_policies
+        self._policies = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Method to get the claims of a policy, creating them when missing. Called with the lock held.
+    def _claims(self, policy_number):
+        claims = self._policies.get(policy_number)
+        if claims is None:
+            claims = self._policies[policy_number] = PolicyClaims()
+            while len(self._policies) > self.max_policies:
+                self._policies.popitem(last=False)
+        else:
+            self._policies.move_to_end(policy_number)
+        return claims
+
+    # Method to build the index record of a claim, with the latest exposure create date precomputed
+    @staticmethod
+    def _to_record(claim):
+        loss_date = claim.get("LossDate")
+        if not loss_date or not claim.get("ClaimNumber"):
+            return None
+
+        latest_create_date = None
+        latest_create_date_str = None
+        for exposure in claim.get("Exposures", []) or []:
+            date_str = exposure.get("CreateDate")
+            if not date_str:
+                continue
+            date = parse_claim_date(date_str)
+            if latest_create_date is None or date > latest_create_date:
+                latest_create_date = date
+                latest_create_date_str = date_str
+
+        return {
+            "ClaimNumber": claim.get("ClaimNumber"),
+            "LossDate": loss_date,
+            "LossTime": parse_claim_date(loss_date).timestamp(),
+            "CreateDate": latest_create_date_str,
+            "CreateTime": latest_create_date.timestamp() if latest_create_date else None,
+            "PolicyType": claim.get("PolicyType"),
+            "ClaimStatus": claim.get("ClaimStatus"),
+            "PolicyNumber": claim.get("PolicyNumber"),
+        }
+
+    # Method to merge the claim list returned by ClaimCenter for a policy
+    def merge(self, policy_number, claim_data):
+        records = [r for r in (self._to_record(claim) for claim in claim_data) if r is not None]
+        with self._lock:
+            claims = self._claims(policy_number)
+            for record in records:
+                claims.insert(record)
+
+    # Method to add a claim we created ourselves, so it is found before the next ClaimCenter refresh
+    def add_claim(self, policy_number, claim_number, loss_date, claim_status="Open", policy_type=None):
+        now = datetime.now(timezone.utc)
+        record = self._to_record({
+            "ClaimNumber": claim_number,
+            "LossDate": loss_date,
+            "PolicyNumber": policy_number,
+            "PolicyType": policy_type,
+            "ClaimStatus": claim_status,
+            "Exposures": [{"CreateDate": now.isoformat()}],
+        })
+        if record is None:
+            return
+        with self._lock:
+            self._claims(policy_number).insert(record)
+
+    # Method to get the claims whose loss date is within max_difference_hours of the given loss date
+    def find(self, policy_number, loss_date, max_difference_hours):
+        loss_time = parse_claim_date(loss_date).timestamp()
+        window = max_difference_hours * 3600
+        with self._lock:
+            claims = self._policies.get(policy_number)
+            if claims is None:
+                return []
+            self._policies.move_to_end(policy_number)
+            start = bisect.bisect_right(claims.loss_times, loss_time - window)
+            end = bisect.bisect_left(claims.loss_times, loss_time + window)
+            return claims.records[start:end]
+
+    def invalidate(self, policy_number):
+        with self._lock:
+            self._policies.pop(policy_number, None)
+
+
+claim_index = ClaimHistoryIndex()
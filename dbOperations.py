@@ -1,13 +1,72 @@
+import json
+import logging
+import os
 import sqlite3
-from datetime import datetime
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
 
 
 DB_NAME = "conversationsID.db"
 
+# Seconds a writer waits for a lock held by another connection before failing
+BUSY_TIMEOUT = float(os.getenv("db_busy_timeout", "10"))
+
+# Columns added after the first release, created on existing databases by init_db
+STATE_COLUMNS = {
+    "policy_number": "TEXT",
+    "loss_date": "TEXT",
+    "policy_status": "TEXT",
+    "duplicate_result": "TEXT",
+    "fnol_payload": "TEXT",
+}
+
+# Conversations older than this many days are removed by the compaction job, 0 keeps them forever
+RETENTION_DAYS = int(os.getenv("conversation_retention_days", "90"))
+COMPACTION_INTERVAL = int(os.getenv("db_compaction_interval_seconds", "3600"))
+COMPRESSION_LEVEL = 6
+
+_local = threading.local()
+
+
+# Method to get the connection of the current thread, opened once per database and reused for every query
+def get_connection(db_name=None):
+    db_name = db_name or DB_NAME
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_name)
+    if conn is None:
+        conn = sqlite3.connect(db_name, timeout=BUSY_TIMEOUT)
+        conn.execute(f'PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        connections[db_name] = conn
+    return conn
+
+
+# Method to close the connections of the current thread
+def close_connection():
+    connections = getattr(_local, "connections", None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
 def init_db():
 
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     c = conn.cursor()
+
+    # Incremental auto vacuum lets the compaction job return freed pages to the OS. It only
+    # takes effect on a new database file, compact_conversations switches existing ones over.
+    c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+    # WAL lets readers run alongside a writer, the setting is persistent for the database file
+    c.execute('PRAGMA journal_mode = WAL')
     c.execute('''
         CREATE TABLE IF NOT EXISTS conversations (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -16,48 +75,169 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+
+    # Migrate databases created before the extraction state was stored
+    existing = {row[1] for row in c.execute('PRAGMA table_info(conversations)')}
+    for column, column_type in STATE_COLUMNS.items():
+        if column not in existing:
+            c.execute(f'ALTER TABLE conversations ADD COLUMN {column} {column_type}')
+
     conn.commit()
-    conn.close()
-    
 
 
-# Method to store the conversation ID and body into the database
-def store_conversation(conversation_id, body):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+# Bodies are stored zlib compressed as BLOBs; rows written before compression hold plain TEXT
+def compress_body(body):
+    if body is None:
+        return None
+    return sqlite3.Binary(zlib.compress(body.encode("utf-8"), COMPRESSION_LEVEL))
+
+
+def decompress_body(value):
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode("utf-8")
+    return value
+
+
+def _conversation_row(conversation_id, body, policy_number=None, loss_date=None, policy_status=None,
+                      duplicate_result=None, fnol_payload=None):
+    return (
+        conversation_id, compress_body(body), datetime.now(), policy_number, loss_date, policy_status,
+        json.dumps(duplicate_result) if duplicate_result is not None else None,
+        json.dumps(fnol_payload) if fnol_payload is not None else None
+    )
+
+
+INSERT_CONVERSATION = '''
+    INSERT OR REPLACE INTO conversations
+        (conversation_id, body, created_at, policy_number, loss_date, policy_status, duplicate_result, fnol_payload)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+# Method to store the conversation ID and body into the database, along with the extraction results
+def store_conversation(conversation_id, body, policy_number=None, loss_date=None, policy_status=None,
+                       duplicate_result=None, fnol_payload=None):
+    conn = get_connection()
     try:
-        c.execute('''
-            INSERT OR REPLACE INTO conversations (conversation_id, body, created_at)
-            VALUES (?, ?, ?)
-        ''', (conversation_id, body, datetime.now()))
-        conn.commit()
+        with conn:
+            conn.execute(INSERT_CONVERSATION, _conversation_row(
+                conversation_id, body, policy_number, loss_date, policy_status, duplicate_result, fnol_payload
+            ))
     except Exception as e:
-        print("[ERROR] Could not store conversation:", e)
-    finally:
-        conn.close()
+        logger.error("Could not store conversation: %s", e)
+
+
+# Method to store many conversations in a single transaction, each item is a dict of store_conversation arguments
+def store_conversations(conversations):
+    conn = get_connection()
+    try:
+        with conn:
+            conn.executemany(INSERT_CONVERSATION, (_conversation_row(**item) for item in conversations))
+        return True
+    except Exception as e:
+        logger.error("Could not store conversations: %s", e)
+        return False
+
+
+# Method to store the generated FNOL payload of a conversation so a later follow-up can reuse it, None clears it
+def store_fnol_payload(conversation_id, fnol_payload):
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute('UPDATE conversations SET fnol_payload = ? WHERE conversation_id = ?',
+                         (json.dumps(fnol_payload) if fnol_payload is not None else None, conversation_id))
+    except Exception as e:
+        logger.error("Could not store FNOL payload: %s", e)
         
 
-# Method to retrieve the conversation body by conversation ID
-def get_conversation_body(conversation_id):
-    
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('SELECT body FROM conversations WHERE conversation_id = ?', (conversation_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        print(f"[DEBUG] Retrieved body length: {len(row[0])}")
-    else:
-        print("[DEBUG] No conversation found for given ID.")
-    return row[0] if row else None
-
-# Method to validate if a conversation ID exists in the database
-def validate_conversation_id(conversation_id):
-
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('SELECT 1 FROM conversations WHERE conversation_id = ?', (conversation_id,))
-    exists = c.fetchone() is not None
-    conn.close()
-    print(f"[DEBUG] Validation result for {conversation_id}: {'FOUND' if exists else 'NOT FOUND'}")
-    return exists
+# Method to retrieve the stored body and extraction results of a conversation in one query.
+# Returns None when the conversation ID does not exist.
+def get_conversation_state(conversation_id):
+
+    row = get_connection().execute('''
+        SELECT body, policy_number, loss_date, policy_status, duplicate_result, fnol_payload
+        FROM conversations WHERE conversation_id = ?
+    ''', (conversation_id,)).fetchone()
+    logger.debug("Validation result for %s: %s", conversation_id, "FOUND" if row else "NOT FOUND")
+    if not row:
+        return None
+
+    return {
+        "body": decompress_body(row[0]),
+        "policy_number": row[1],
+        "loss_date": row[2],
+        "policy_status": row[3],
+        "duplicate_result": json.loads(row[4]) if row[4] else None,
+        "fnol_payload": json.loads(row[5]) if row[5] else None,
+    }
+
+# Method to delete conversations older than the retention window and release the freed pages
+def compact_conversations(retention_days=None):
+    retention_days = RETENTION_DAYS if retention_days is None else retention_days
+    conn = get_connection()
+    deleted = 0
+    if retention_days > 0:
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        with conn:
+            deleted = conn.execute('DELETE FROM conversations WHERE created_at < ?', (cutoff,)).rowcount
+
+    auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    if auto_vacuum == 2:
+        conn.execute('PRAGMA incremental_vacuum')
+    elif deleted:
+        # Databases created before incremental auto vacuum switch over with one full VACUUM. The
+        # pragma is per connection, so it has to be set on the connection running the VACUUM.
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return deleted
+
+
+# Method to report the size of the conversations database
+def get_storage_report():
+    conn = get_connection()
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    rows, body_bytes, compressed_rows, oldest = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(body AS BLOB))), 0), COALESCE(SUM(typeof(body) = 'blob'), 0),
+               MIN(created_at)
+        FROM conversations
+    ''').fetchone()
+    return {
+        "rows": rows,
+        "compressedRows": compressed_rows,
+        "bodyBytes": body_bytes,
+        "fileBytes": page_size * page_count,
+        "freeBytes": page_size * freelist_count,
+        "oldestConversation": oldest,
+        "retentionDays": RETENTION_DAYS,
+    }
+
+
+_compaction_thread = None
+
+
+# Method to start the background job that periodically runs compact_conversations, followed by
+# the cleanup functions given in extra_tasks
+def start_compaction_job(interval=COMPACTION_INTERVAL, extra_tasks=()):
+    global _compaction_thread
+    if _compaction_thread is not None or interval <= 0:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                deleted = compact_conversations()
+                logger.info("Compaction removed %d conversations", deleted)
+            except Exception:
+                logger.exception("Conversation compaction failed")
+            for task in extra_tasks:
+                try:
+                    logger.info("%s removed %d rows", task.__name__, task())
+                except Exception:
+                    logger.exception("%s failed", task.__name__)
+
+    _compaction_thread = threading.Thread(target=run, name="db-compaction", daemon=True)
+    _compaction_thread.start()
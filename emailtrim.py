@@ -0,0 +1,134 @@
+import re
+import threading
+from extractor import POLICY_NUMBER_LABELLED, DATE_PATTERNS, LOSS_DATE_LABEL, extract_policy_number, extract_loss_date
+
+# Removal of quoted reply history, signatures and legal footers from the text of an email,
+# so only the new content of the message is sent to Gen AI and stored
+
+# Start of a quoted message: everything after it is history
+REPLY_HEADERS = [
+    re.compile(r"^On\b.{0,200}\bwrote:\s*$", re.I),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}\s*$", re.I),
+    re.compile(r"^_{10,}\s*$"),
+]
+FORWARD_HEADERS = [
+    re.compile(r"^-{2,}\s*Forwarded message\s*-{2,}\s*$", re.I),
+    re.compile(r"^Begin forwarded message:\s*$", re.I),
+]
+# Outlook style header block: From: followed by Sent:/Date: and To:/Subject: lines
+HEADER_FIELD = re.compile(r"^(From|Sent|Date|To|Cc|Subject)\s*:", re.I)
+FORWARD_SUBJECT = re.compile(r"^Subject\s*:\s*(fw|fwd)\s*:", re.I)
+
+SIGNATURE_START = re.compile(
+    r"^(--\s*|(thanks|thank you|many thanks|regards|best regards|kind regards|warm regards|best|cheers|"
+    r"sincerely|yours (truly|sincerely))\s*[,!.]?|sent from my \w+.*)$", re.I
+)
+# Lines after the sign-off that are still taken as the signature (name, title, phone, ...)
+MAX_SIGNATURE_LINES = 6
+
+LEGAL_FOOTER = re.compile(
+    r"(confidential|privileged).{0,200}(intended (solely )?for|recipient|disclos|prohibited)|"
+    r"^disclaimer\b|please consider the environment before printing|"
+    r"this (e-?mail|message) (and any attachments )?(is|may be|was) (sent|scanned|monitored|confidential)",
+    re.I
+)
+LOSS_KEYWORDS = re.compile(r"\b(loss|incident|accident|occurred|happened|damage|claim)\b", re.I)
+
+_stats = {"emails": 0, "trimmed": 0, "input_chars": 0, "removed_chars": 0}
+_stats_lock = threading.Lock()
+
+
+def _header_kind(lines, i):
+    line = lines[i]
+    if any(pattern.match(line) for pattern in FORWARD_HEADERS):
+        return "forward"
+    if any(pattern.match(line) for pattern in REPLY_HEADERS):
+        return "reply"
+    # "On <date>, <name>" and "wrote:" split over two lines
+    if i + 1 < len(lines) and line.lower().startswith("on ") and lines[i + 1].lower().endswith("wrote:"):
+        return "reply"
+    if line.lower().startswith("from:"):
+        fields = {HEADER_FIELD.match(l).group(1).lower() for l in lines[i:i + 6] if HEADER_FIELD.match(l)}
+        if fields & {"sent", "date"} and fields & {"to", "subject"}:
+            return "forward" if any(FORWARD_SUBJECT.match(l) for l in lines[i:i + 6]) else "reply"
+    return None
+
+
+# Method to split the lines into the new content and the quoted messages after it
+def _split_messages(lines):
+    messages = [(None, [])]
+    for i, line in enumerate(lines):
+        kind = _header_kind(lines, i)
+        if kind is not None:
+            messages.append((kind, []))
+        messages[-1][1].append(line)
+    return messages
+
+
+def _strip_header(lines):
+    i = 0
+    while i < len(lines) and (i == 0 or HEADER_FIELD.match(lines[i]) or lines[i].lower().endswith("wrote:")):
+        i += 1
+    return lines[i:]
+
+
+def _strip_signature_and_footer(lines):
+    lines = [line for line in lines if not line.startswith(">") and not LEGAL_FOOTER.search(line)]
+    for i, line in enumerate(lines):
+        if i > 0 and SIGNATURE_START.match(line) and len(lines) - i - 1 <= MAX_SIGNATURE_LINES:
+            # A sign-off followed by claim details is not a signature
+            if not any(_is_context_line(tail, True, True) for tail in lines[i + 1:]):
+                return lines[:i]
+    return lines
+
+
+def _is_context_line(line, need_policy, need_date):
+    if need_policy and POLICY_NUMBER_LABELLED.search(line):
+        return True
+    if need_date and (LOSS_KEYWORDS.search(line) or LOSS_DATE_LABEL.search(line)):
+        return any(pattern.search(line) for pattern in DATE_PATTERNS)
+    return False
+
+
+# Method to trim an email given as lines of text (see htmltext.html_to_text keep_lines).
+# Returns the kept text, one line per line, and the number of characters removed.
+def trim_email(text):
+    lines = [line.strip() for line in text.split("\n") if line.strip()]
+    messages = _split_messages(lines)
+
+    kept = _strip_signature_and_footer(messages[0][1])
+    history = messages[1:]
+    quoted = [line for line in messages[0][1] if line.startswith(">")]
+
+    # In a forward the first quoted message is the content
+    if history and history[0][0] == "forward":
+        forwarded = [line.lstrip("> ") for line in _strip_header(history[0][1])]
+        kept += _strip_signature_and_footer(forwarded)
+        history = history[1:]
+
+    # Keep the lines of the history the extraction still needs
+    content = "\n".join(kept)
+    need_policy = extract_policy_number(content)[0] is None
+    need_date = extract_loss_date(content)[0] is None
+    if need_policy or need_date:
+        history_lines = quoted + [line for _, message in history for line in message]
+        kept += [
+            line.lstrip("> ") for line in history_lines
+            if _is_context_line(line.lstrip("> "), need_policy, need_date)
+        ]
+
+    trimmed = "\n".join(kept)
+    removed = max(0, len(text) - len(trimmed))
+    with _stats_lock:
+        _stats["emails"] += 1
+        _stats["input_chars"] += len(text)
+        _stats["removed_chars"] += removed
+        if len(kept) < len(lines):
+            _stats["trimmed"] += 1
+
+    return trimmed, removed
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
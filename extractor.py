@@ -0,0 +1,203 @@
+import os
+import re
+import threading
+from datetime import datetime, timezone
+
+# Rule based extraction of the policy number and loss date, used before falling back to Gen AI
+
+MIN_CONFIDENCE = float(os.getenv("fast_extract_min_confidence", "0.8"))
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_MONTH = r"(?P<month_name>jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sept?(?:ember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?"
+
+POLICY_NUMBER_LABELLED = re.compile(
+    r"\bpolicy\s*(?:number|num|no\.?|id|#)?\s*(?:is|:|-|=)?\s*#?\s*(?P<number>\d{5,15})\b", re.I
+)
+NUMBER_CANDIDATE = re.compile(r"(?<![\d/\-.:])\d{6,15}(?![\d/\-.:])")
+
+DATE_PATTERNS = [
+    # 2025-07-22, 2025-07-22T22:30:00Z, 2025/07/22 22:30
+    re.compile(r"\b(?P<year>\d{4})[-/](?P<month>\d{1,2})[-/](?P<day>\d{1,2})(?:[T ](?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?(?:\.\d+)?Z?)?\b"),
+    # 07/22/2025, 7-22-25, 22.07.2025
+    re.compile(r"\b(?P<first>\d{1,2})[/\-.](?P<second_part>\d{1,2})[/\-.](?P<year>\d{4}|\d{2})\b"),
+    # July 22, 2025 / Jul 22nd 2025
+    re.compile(_MONTH + r"\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?,?\s+(?P<year>\d{4})\b", re.I),
+    # 22 July 2025 / 22nd of July, 2025 / 22-Jul-2025
+    re.compile(r"\b(?P<day>\d{1,2})(?:st|nd|rd|th)?(?:\s+of)?[\s\-]+" + _MONTH + r",?[\s\-]+(?P<year>\d{4})\b", re.I),
+]
+
+TIME_PATTERN = re.compile(
+    r"\b(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?(?::(?P<second>\d{2}))?\s*(?P<ampm>[ap]\.?m\.?)?(?![\w/])", re.I
+)
+# Words joining a date and its time: "07/22/2025 at 3pm", "July 22 around 15:30"
+TIME_CONNECTOR = r"[\s,]*(?:(?:at|@|around|about|approx(?:imately|\.)?|roughly|near|by|~)\s*)*"
+# Signs of a time of day next to a date, used to tell a date without a time from a time we could not read
+TIME_HINT = re.compile(
+    r"\b(?:\d{1,2}(?::\d{2})?\s*[ap]\.?m\b\.?|\d{1,2}:\d{2}|\d{1,2}\s*(?:hrs|hours|h)\b|noon|midnight|"
+    r"morning|afternoon|evening|night|o'?clock)", re.I
+)
+# Confidence of a date whose time could not be read, low enough to leave it to Gen AI
+UNREAD_TIME_CONFIDENCE = 0.5
+LOSS_DATE_LABEL = re.compile(
+    r"(loss\s*date|date\s*of\s*(?:the\s*)?(?:loss|incident|accident)|(?:incident|accident)\s*date|"
+    r"occurred|happened|took\s*place)[^.\n]{0,25}$", re.I
+)
+
+_stats = {"attempts": 0, "hits": 0, "fallbacks": 0}
+_stats_lock = threading.Lock()
+
+
+def _year(value):
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+# Method to find a time of day next to a date match, either right after it or right before it.
+# Returns None when the text around the date mentions a time that could not be read.
+def _find_time(text, start, end):
+    after = text[end:end + 30]
+    match = re.match(TIME_CONNECTOR + TIME_PATTERN.pattern, after, re.I)
+    if not match or not (match.group("minute") or match.group("ampm")):
+        before = text[max(0, start - 30):start]
+        match = re.search(r"(?:at|@|around|about)\s*" + TIME_PATTERN.pattern + r"\s*(?:on|,)?\s*$", before, re.I)
+        if not match or not (match.group("minute") or match.group("ampm")):
+            if TIME_HINT.search(after) or TIME_HINT.search(before):
+                return None
+            return 0, 0, 0
+
+    hour = int(match.group("hour"))
+    minute = int(match.group("minute") or 0)
+    second = int(match.group("second") or 0)
+    ampm = (match.group("ampm") or "").replace(".", "").lower()
+    if ampm == "pm" and hour < 12:
+        hour += 12
+    elif ampm == "am" and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+    return hour, minute, second
+
+
+# Method to turn a date pattern match into a datetime and a confidence
+def _parse_date_match(text, match):
+    parts = match.groupdict()
+    confidence = 1.0
+
+    if parts.get("month_name"):
+        month = MONTHS[parts["month_name"].lower()[:3]]
+        day = int(parts["day"])
+    elif parts.get("first"):
+        first, second = int(parts["first"]), int(parts["second_part"])
+        if first > 12:
+            day, month = first, second
+        else:
+            # US month/day ordering; ambiguous when both parts could be a month
+            month, day = first, second
+            if second <= 12 and first != second:
+                confidence = 0.7
+    else:
+        month, day = int(parts["month"]), int(parts["day"])
+
+    if parts.get("hour") is not None:
+        hour, minute, second = int(parts["hour"]), int(parts["minute"]), int(parts.get("second") or 0)
+    else:
+        time_of_day = _find_time(text, match.start(), match.end())
+        if time_of_day is None:
+            # The date alone would be off by up to a day, which matters for the duplicate window
+            confidence = min(confidence, UNREAD_TIME_CONFIDENCE)
+            time_of_day = (0, 0, 0)
+        hour, minute, second = time_of_day
+
+    try:
+        value = datetime(_year(parts["year"]), month, day, hour, minute, second, tzinfo=timezone.utc)
+    except ValueError:
+        return None, 0.0
+
+    if value > datetime.now(timezone.utc):
+        confidence = min(confidence, 0.3)
+    return value, confidence
+
+
+# Method to extract the policy number along with a confidence score
+def extract_policy_number(text):
+    labelled = {m.group("number") for m in POLICY_NUMBER_LABELLED.finditer(text)}
+    if len(labelled) == 1:
+        return labelled.pop(), 0.95
+    if len(labelled) > 1:
+        return None, 0.0
+
+    candidates = set(NUMBER_CANDIDATE.findall(text))
+    if len(candidates) == 1:
+        return candidates.pop(), 0.6
+    return None, 0.0
+
+
+# Method to extract the loss date along with a confidence score
+def extract_loss_date(text):
+    found = []
+    covered = []
+    for pattern in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            if any(match.start() < end and start < match.end() for start, end in covered):
+                continue
+            covered.append((match.start(), match.end()))
+            value, confidence = _parse_date_match(text, match)
+            if value is None:
+                continue
+            labelled = LOSS_DATE_LABEL.search(text[max(0, match.start() - 60):match.start()]) is not None
+            found.append((value, confidence, labelled))
+
+    if not found:
+        return None, 0.0
+
+    labelled = {f[0]: f[1] for f in found if f[2]}
+    if len(labelled) == 1:
+        value, confidence = labelled.popitem()
+        return value, min(confidence, 0.95)
+
+    distinct = {f[0]: f[1] for f in found}
+    if len(distinct) == 1:
+        value, confidence = distinct.popitem()
+        return value, min(confidence, 0.85)
+
+    return None, 0.0
+
+
+# Method to format a loss date the way the Gen AI extraction returns it
+def format_loss_date(value):
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+# Method to extract the policy number and loss date from the email text without calling Gen AI.
+# Returns the policy number, the ISO loss date and the overall confidence.
+def extract_fields(text):
+    policy_number, number_confidence = extract_policy_number(text)
+    loss_date, date_confidence = extract_loss_date(text)
+    if policy_number is None or loss_date is None:
+        return policy_number, format_loss_date(loss_date) if loss_date else None, 0.0
+
+    return policy_number, format_loss_date(loss_date), min(number_confidence, date_confidence)
+
+
+# Method to try the rule based extraction, recording whether it saved a Gen AI call
+def try_fast_path(text, min_confidence=None):
+    policy_number, loss_date, confidence = extract_fields(text)
+    hit = confidence >= (MIN_CONFIDENCE if min_confidence is None else min_confidence)
+
+    with _stats_lock:
+        _stats["attempts"] += 1
+        _stats["hits" if hit else "fallbacks"] += 1
+
+    if hit:
+        return policy_number, loss_date
+    return None, None
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result["hit_rate"] = round(result["hits"] / result["attempts"], 4) if result["attempts"] else 0.0
+    return result
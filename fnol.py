@@ -0,0 +1,158 @@
+import json
+from datetime import datetime
+from functools import lru_cache
+
+# Master data and local validation of the FNOL payload sent to the createFNOL API
+
+TEMPLATE_FILE = "claim_template.json"
+
+# Values accepted by ClaimCenter, also listed in the generate_response prompt
+MASTER_DATA = {
+    "ClaimantType": [
+        "insured", "householdmember", "propertyowner", "customer", "employee", "other",
+    ],
+    "PolicyType": [
+        "BusinessOwners", "BusinessAuto", "CommercialPackage", "CommercialProperty", "farmowners",
+        "GeneralLiability", "HOPHomeowners", "InlandMarine", "PersonalAuto", "travel_per",
+        "PersonalUmbrella", "prof_liability", "WorkersComp", "D and 0",
+    ],
+    "RelationshipToInsured": [
+        "self", "agent", "attorney", "employee", "claimant", "claimantatty", "rentalrep", "repairshop", "other",
+    ],
+    "LossCause": [
+        "animal_bite", "burglary", "earthquake", "explosion", "fire", "glassbreakage", "hail", "hurricane",
+        "vandalism", "mold", "riotandcivil", "snowice", "structfailure", "waterdamage", "wind",
+    ],
+}
+
+REQUIRED_FIELDS = ("PolicyNumber", "LossDate")
+
+
+@lru_cache(maxsize=1)
+def load_claim_template():
+    with open(TEMPLATE_FILE, 'r') as f:
+        return json.load(f)
+
+
+# Method to derive the Gemini response schema of a JSON template: objects keep their keys,
+# lists take the schema of their first item and every leaf is a string
+def template_schema(template):
+    if isinstance(template, dict):
+        return {"type": "OBJECT", "properties": {key: template_schema(value) for key, value in template.items()}}
+    if isinstance(template, list):
+        return {"type": "ARRAY", "items": template_schema(template[0] if template else "")}
+    return {"type": "STRING"}
+
+
+@lru_cache(maxsize=1)
+def claim_response_schema():
+    return template_schema(load_claim_template())
+
+
+# Method to render the master data block of the prompt
+def format_master_data():
+    return "\n\n".join(
+        f"{field}:\n" + "\n".join(f"- {value}" for value in values)
+        for field, values in MASTER_DATA.items()
+    )
+
+
+def _validate_value(value, template, path, errors):
+    if isinstance(template, dict):
+        if not isinstance(value, dict):
+            errors.append(f"{path} must be an object")
+            return
+        for key, item in value.items():
+            item_path = f"{path}.{key}" if path else key
+            if key in template:
+                _validate_value(item, template[key], item_path, errors)
+            if key in MASTER_DATA and item not in (None, "") and item not in MASTER_DATA[key]:
+                errors.append(f"{item_path} has invalid value {item!r}")
+
+    elif isinstance(template, list):
+        if not isinstance(value, list):
+            errors.append(f"{path} must be a list")
+            return
+        if template:
+            for i, item in enumerate(value):
+                _validate_value(item, template[0], f"{path}[{i}]", errors)
+
+    elif value is not None and not isinstance(value, (str, int, float)):
+        errors.append(f"{path} must be a scalar value")
+
+
+# Method to check a generated payload against the claim template and the master data.
+# Returns the list of problems found, empty when the payload can be sent.
+def validate_fnol_payload(payload):
+    if not isinstance(payload, dict):
+        return ["payload must be a JSON object"]
+
+    errors = []
+    _validate_value(payload, load_claim_template(), "", errors)
+
+    for field in REQUIRED_FIELDS:
+        if not payload.get(field):
+            errors.append(f"{field} is required")
+
+    loss_date = payload.get("LossDate")
+    if isinstance(loss_date, str) and loss_date:
+        try:
+            datetime.fromisoformat(loss_date.replace("Z", "+00:00"))
+        except ValueError:
+            errors.append(f"LossDate {loss_date!r} is not an ISO 8601 date")
+
+    return errors
+
+
+def _coverage_key(value):
+    return str(value or "").strip().lower()
+
+
+# Method to fill the policy dependent fields of a claim drafted without the policy details.
+# Coverage types are taken from the matching policy coverage and coverages the policy does
+# not have are dropped, the same rules the generate_response prompt gives to Gen AI.
+def complete_fnol_payload(payload, snapshot, policy_number, loss_date):
+    if not isinstance(payload, dict):
+        return payload
+
+    payload = dict(payload)
+    payload["PolicyNumber"] = policy_number
+    if loss_date:
+        payload["LossDate"] = loss_date
+    if snapshot.policy_type in MASTER_DATA["PolicyType"]:
+        payload["PolicyType"] = snapshot.policy_type
+
+    coverages = {}
+    for coverage in snapshot.coverages:
+        for name in (coverage.get("Name"), coverage.get("PatternCode")):
+            if name:
+                coverages.setdefault(_coverage_key(name), coverage)
+
+    vehicles = []
+    for vehicle in payload.get("InvolvedVehicles") or []:
+        if not isinstance(vehicle, dict):
+            continue
+        involved = []
+        for item in vehicle.get("InvolvedCoverage") or []:
+            coverage = coverages.get(_coverage_key(item.get("Coverage"))) if isinstance(item, dict) else None
+            if coverage is None:
+                continue
+            coverage_type = coverage.get("CoverageType") or coverage.get("PatternCode")
+            involved.append(dict(item, CoverageType=coverage_type, CoverageSubtype=coverage_type))
+        vehicle = dict(vehicle)
+        if involved:
+            vehicle["InvolvedCoverage"] = involved
+        else:
+            vehicle.pop("InvolvedCoverage", None)
+        vehicles.append(vehicle)
+    if "InvolvedVehicles" in payload:
+        payload["InvolvedVehicles"] = vehicles
+
+    # Address of the insured when the email does not give one
+    address = snapshot.address or {}
+    for field, source in (("AddressLine1", "AddressLine1"), ("City", "City"), ("State", "State"),
+                          ("ZipCode", "PostalCode")):
+        if not payload.get(field) and address.get(source):
+            payload[field] = address[source]
+
+    return payload
@@ -0,0 +1,75 @@
+import os
+import threading
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+# Load environment variables from .env file
+load_dotenv()
+
+PC_BASE_URL = os.getenv("pc_base_url", "http://18.218.57.115:8190/pc/rest")
+CC_BASE_URL = os.getenv("cc_base_url", "http://18.218.57.115:8090/cc/rest")
+AUTHORIZATION = os.getenv("gw_authorization", "Basic c3U6Z3c=")
+
+# Connection pool sizes per host. Every request being served can hold one connection to each
+# host, so the pool defaults to the server thread count.
+POOL_CONNECTIONS = int(os.getenv("gw_pool_connections", "4"))
+POOL_MAXSIZE = int(os.getenv("gw_pool_maxsize", os.getenv("serve_threads", "200")))
+
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("gw_connect_timeout", "3.05"))
+
+# Endpoint name -> (base url, path, content type, default read timeout in seconds)
+ENDPOINTS = {
+    "latestDetailsBasedOnAccOrPocNo": (PC_BASE_URL, "/policy/v1/latestDetailsBasedOnAccOrPocNo", "text/plain", 15),
+    "getClaimDetails": (CC_BASE_URL, "/claimdetails/v1/getClaimDetails", "application/json", 10),
+    "createFNOL": (CC_BASE_URL, "/fnol/v1/createFNOL", "application/json", 60),
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+# Method to get the shared keep-alive session for a Guidewire host
+def get_session(base_url):
+    session = _sessions.get(base_url)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=True)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"Authorization": AUTHORIZATION})
+            _sessions[base_url] = session
+    return session
+
+
+# Method to get the (connect, read) timeout of an endpoint, overridable per endpoint from the environment
+def get_timeout(endpoint):
+    read_timeout = ENDPOINTS[endpoint][3]
+    connect = float(os.getenv(f"gw_{endpoint}_connect_timeout", DEFAULT_CONNECT_TIMEOUT))
+    read = float(os.getenv(f"gw_{endpoint}_read_timeout", read_timeout))
+    return connect, read
+
+
+# Method to call a Guidewire REST endpoint through the pooled session
+def post(endpoint, data):
+    base_url, path, content_type, _ = ENDPOINTS[endpoint]
+    session = get_session(base_url)
+    return session.post(
+        base_url + path,
+        headers={"Content-Type": content_type},
+        data=data,
+        timeout=get_timeout(endpoint)
+    )
+
+
+# Method to close all pooled connections
+def close():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,173 @@
+import codecs
+import html
+import os
+import re
+from html.parser import HTMLParser
+
+# Streaming HTML to text conversion of email bodies. The request body is read in chunks up to
+# the input cap, inline images dropped, and fed to the parser until the text cap is reached.
+
+MAX_INPUT_CHARS = int(os.getenv("email_max_input_chars", "2000000"))
+MAX_TEXT_CHARS = int(os.getenv("email_max_text_chars", "200000"))
+CHUNK_SIZE = 64 * 1024
+
+# Elements whose content is never text of the email
+SKIPPED_TAGS = frozenset(("script", "style", "head", "noscript", "template"))
+
+# Elements that start a new line of text
+BLOCK_TAGS = frozenset((
+    "address", "article", "blockquote", "br", "dd", "div", "dl", "dt", "footer", "form", "h1", "h2", "h3",
+    "h4", "h5", "h6", "header", "hr", "li", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul",
+))
+
+# Inline images and attachments pasted into the text. In attributes they are never read as text.
+_DATA_URI = re.compile(r"data:[\w.+-]+/[\w.+-]+(?:;[\w=.-]+)*;base64,[A-Za-z0-9+/=\s]*", re.IGNORECASE)
+_LITERAL_NEWLINE = re.compile(r"(\\n|/n|\n|\r)")
+_WHITESPACE = re.compile(r"\s+")
+_LINE_WHITESPACE = re.compile(r"[^\S\n]+")
+
+
+# Method to drop quoted data: URI attribute values (inline images), which can be megabytes
+# long. Only str.find is used, so the cost does not depend on the size of the values.
+def _strip_data_uris(source):
+    parts = []
+    position = 0
+    while True:
+        start = source.find("data:", position)
+        if start < 0:
+            break
+        quote = source[start - 1] if start > 0 else ""
+        end = source.find(quote, start) if quote in ("\"", "'") else -1
+        if end < 0:
+            parts.append(source[position:start + 5])
+            position = start + 5
+            continue
+        parts.append(source[position:start])
+        position = end
+    if not parts:
+        return source
+    parts.append(source[position:])
+    return "".join(parts)
+
+
+# Method to read an email body from a binary stream without holding more than max_input_chars
+# of it. Quoted data: URI values are dropped while reading, so inline images do not count
+# towards the cap; the part of the body past the cap is read and discarded.
+def read_email_body(stream, max_input_chars=MAX_INPUT_CHARS, encoding="utf-8"):
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    parts = []
+    length = 0
+    pending = ""
+    skip_quote = None
+    previous = ""
+
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        final = not chunk
+        pending += decoder.decode(chunk or b"", final=final)
+
+        while pending and length < max_input_chars:
+            if skip_quote:
+                end = pending.find(skip_quote)
+                if end < 0:
+                    pending = ""
+                    break
+                pending = pending[end:]
+                skip_quote = None
+
+            start = pending.find("data:")
+            if start < 0:
+                # "data:" may continue in the next chunk
+                keep = 0 if final else min(len(pending), 4)
+                kept, pending = pending[:len(pending) - keep], pending[len(pending) - keep:]
+            else:
+                quote = pending[start - 1] if start > 0 else previous
+                if quote in ("\"", "'"):
+                    kept, pending = pending[:start], pending[start:]
+                    skip_quote = quote
+                else:
+                    kept, pending = pending[:start + 5], pending[start + 5:]
+
+            if kept:
+                kept = kept[:max_input_chars - length]
+                parts.append(kept)
+                length += len(kept)
+                previous = kept[-1]
+            elif start < 0:
+                break
+
+        if length >= max_input_chars:
+            pending = ""
+        if final:
+            break
+
+    return "".join(parts)
+
+
+class _TextExtractor(HTMLParser):
+
+    def __init__(self, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.length = 0
+        self.max_chars = max_chars
+        self.skip_depth = 0
+        self.in_text = False
+
+    @property
+    def full(self):
+        return self.length >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        self.in_text = False
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        self.in_text = False
+        if tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        self.in_text = False
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self.skip_depth or self.full:
+            return
+        # Text split over two chunks arrives in two calls
+        if self.in_text:
+            self.parts[-1] += data
+        else:
+            self.parts.append(data)
+            self.in_text = True
+        self.length += len(data)
+
+
+# Method to convert an HTML email body to plain text. With keep_lines the line structure of
+# the body is kept (one line per block element), otherwise all whitespace becomes single spaces.
+def html_to_text(html_content, keep_lines=False, max_input_chars=MAX_INPUT_CHARS, max_text_chars=MAX_TEXT_CHARS):
+    if not html_content:
+        return ""
+
+    source = _strip_data_uris(html_content[:max_input_chars])
+    parser = _TextExtractor(max_text_chars)
+    for start in range(0, len(source), CHUNK_SIZE):
+        parser.feed(source[start:start + CHUNK_SIZE])
+        if parser.full:
+            break
+    else:
+        parser.close()
+
+    text = _DATA_URI.sub("", html.unescape(" ".join(parser.parts))[:max_text_chars])
+
+    if not keep_lines:
+        return _WHITESPACE.sub(" ", _LITERAL_NEWLINE.sub(" ", text)).strip()
+
+    lines = (_LINE_WHITESPACE.sub(" ", line).strip() for line in _LITERAL_NEWLINE.sub("\n", text).split("\n"))
+    return "\n".join(line for line in lines if line)
@@ -0,0 +1,274 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+from utils import get_email_intent
+
+# Local intent classification of follow-up emails (SystemMessage, Proceed, Acknowledge): phrase
+# rules first, then a naive Bayes model with temperature-calibrated confidence. Gen AI
+# (utils.get_email_intent) is only asked when both are unsure.
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INTENTS = ("SystemMessage", "Proceed", "Acknowledge")
+
+MIN_CONFIDENCE = float(os.getenv("intent_min_confidence", "0.75"))
+# Optional JSON lines file of labelled emails, {"text": ..., "intent": ...} per line
+TRAINING_FILE = os.getenv("intent_training_file", "intentExamples.jsonl")
+
+# The few-shot examples of the get_email_intent prompt, and emails of the same kinds
+EXAMPLES = [
+    ("Please proceed with my claim, I agree with your assessment.", "Proceed"),
+    ("I understand there might be a duplicate, but I want to go ahead with the claim.", "Proceed"),
+    ("Yes, go ahead and file it.", "Proceed"),
+    ("Please proceed", "Proceed"),
+    ("Continue with the process", "Proceed"),
+    ("Proceed with my claim", "Proceed"),
+    ("Please start the process", "Proceed"),
+    ("I want to file this claim", "Proceed"),
+    ("This is a different incident, please create a new claim.", "Proceed"),
+    ("It is not a duplicate, the damage happened on another day. Please file it.", "Proceed"),
+    ("Yes please, go ahead with the claim.", "Proceed"),
+    ("Kindly process my claim as a new one.", "Proceed"),
+    ("I confirm, please submit the claim.", "Proceed"),
+    ("Please move forward with the claim process.", "Proceed"),
+    ("Thanks for letting me know about the duplicate claim.", "Acknowledge"),
+    ("I appreciate your quick response.", "Acknowledge"),
+    ("Thank you", "Acknowledge"),
+    ("Got it", "Acknowledge"),
+    ("I appreciate your help", "Acknowledge"),
+    ("Noted", "Acknowledge"),
+    ("Thanks for letting me know", "Acknowledge"),
+    ("Okay, thank you for the update.", "Acknowledge"),
+    ("Understood, no need to file another claim then.", "Acknowledge"),
+    ("Thanks, I will wait for the adjuster to contact me.", "Acknowledge"),
+    ("Received, thank you very much.", "Acknowledge"),
+    ("Great, thanks for your help with this.", "Acknowledge"),
+    ("Ok that is the same claim, please do not proceed.", "Acknowledge"),
+    ("Claim Number: 000-00-004665 has been successfully registered.", "SystemMessage"),
+    ("Your claim has been registered. Claim number 000-00-004711. This is an automated message.", "SystemMessage"),
+    ("This is an automated message, please do not reply to this email.", "SystemMessage"),
+    ("Status update: your claim is now under review by an adjuster.", "SystemMessage"),
+    ("A possible duplicate claim was found for your policy. Reply proceed to file a new claim.", "SystemMessage"),
+    ("Delivery has failed to these recipients or groups.", "SystemMessage"),
+    ("Automatic reply: I am out of the office until Monday.", "SystemMessage"),
+    ("Your policy is not eligible for a claim. Please contact your agent.", "SystemMessage"),
+    ("Claim created successfully. Claim number 000-00-001234.", "SystemMessage"),
+    ("This email and any attachments are confidential. Do not reply to this automated notification.", "SystemMessage"),
+]
+
+# Phrases that decide the intent on their own. SystemMessage only lists wording a person would
+# not write. When SystemMessage and a non-negated Proceed both match, the rules do not decide
+# and the email is left to the model; otherwise the first one in RULES wins, so "Thank you.
+# Proceed." asks us to proceed.
+RULES = {
+    "SystemMessage": re.compile(
+        r"\b(has been successfully (registered|created)|claim (was )?created successfully|automated "
+        r"(message|notification)|automatic reply|delivery has failed|undeliverable|reply (with )?proceed)\b", re.I),
+    "Proceed": re.compile(
+        r"\b(proceed|go ahead|file (it|this|the claim)|continue with|start the process|move forward|"
+        r"process (my|the|this) claim|submit the claim|create a new claim|want to file)\b", re.I),
+    "Acknowledge": re.compile(
+        r"^\W*(ok(ay)?|got it|noted|understood|received|thx)\W*$|\b(thanks|thank you|i appreciate|appreciate it)\b",
+        re.I),
+}
+NEGATION = re.compile(r"\b(do not|don't|dont|no need to|not to|never|cancel)\b\W+(\w+\W+){0,2}"
+                      r"(proceed|go ahead|file|continue|submit|create)", re.I)
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+
+
+def tokenize(text):
+    words = _TOKEN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class NaiveBayesIntentModel:
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.temperature = 1.0
+        self.word_counts = {}
+        self.totals = {}
+        self.priors = {}
+        self.vocabulary = set()
+
+    def fit(self, examples):
+        self.word_counts = {intent: Counter() for intent in INTENTS}
+        documents = Counter()
+        for text, intent in examples:
+            documents[intent] += 1
+            self.word_counts[intent].update(tokenize(text))
+        self.vocabulary = set().union(*self.word_counts.values())
+        self.totals = {intent: sum(counts.values()) for intent, counts in self.word_counts.items()}
+        total = sum(documents.values())
+        self.priors = {intent: math.log((documents[intent] + 1) / (total + len(INTENTS))) for intent in INTENTS}
+        return self
+
+    def log_scores(self, text):
+        tokens = [t for t in tokenize(text) if t in self.vocabulary]
+        size = len(self.vocabulary)
+        scores = {}
+        for intent in INTENTS:
+            counts = self.word_counts[intent]
+            denominator = math.log(self.totals[intent] + self.alpha * size)
+            scores[intent] = self.priors[intent] + sum(
+                math.log(counts[t] + self.alpha) - denominator for t in tokens
+            )
+        return scores
+
+    # Method to get the probability of each intent, softened by the calibrated temperature
+    def predict_proba(self, text, temperature=None):
+        temperature = temperature or self.temperature
+        scores = {intent: score / temperature for intent, score in self.log_scores(text).items()}
+        top = max(scores.values())
+        exps = {intent: math.exp(score - top) for intent, score in scores.items()}
+        total = sum(exps.values())
+        return {intent: value / total for intent, value in exps.items()}
+
+    def predict(self, text):
+        probabilities = self.predict_proba(text)
+        intent = max(probabilities, key=probabilities.get)
+        return intent, probabilities[intent]
+
+
+# Method to choose the temperature that minimises the log loss of cross-validated predictions,
+# so the confidence of the model matches how often it is right. Returns the per-intent accuracy.
+def calibrate(model, examples, alpha=1.0, folds=5):
+    held_out = []
+    for k in range(folds):
+        fold = NaiveBayesIntentModel(alpha).fit([e for i, e in enumerate(examples) if i % folds != k])
+        held_out.extend((fold, text, intent) for text, intent in examples[k::folds])
+
+    best = None
+    for temperature in (0.5, 0.75, 1, 1.5, 2, 3, 4, 6, 8):
+        loss = -sum(math.log(max(fold.predict_proba(text, temperature)[intent], 1e-12))
+                    for fold, text, intent in held_out)
+        if best is None or loss < best[0]:
+            best = (loss, temperature)
+    model.temperature = best[1]
+
+    correct, seen = Counter(), Counter()
+    for fold, text, intent in held_out:
+        seen[intent] += 1
+        if fold.predict(text)[0] == intent:
+            correct[intent] += 1
+    return {intent: round(correct[intent] / seen[intent], 4) if seen[intent] else None for intent in INTENTS}
+
+
+def _load_examples():
+    examples = list(EXAMPLES)
+    if TRAINING_FILE and os.path.exists(TRAINING_FILE):
+        with open(TRAINING_FILE, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if item.get("intent") in INTENTS and item.get("text"):
+                    examples.append((item["text"], item["intent"]))
+    return examples
+
+
+def match_rules(text):
+    matched = []
+    for intent, pattern in RULES.items():
+        if not pattern.search(text):
+            continue
+        # "please do not proceed" is left to the next rules or the model
+        if intent == "Proceed" and NEGATION.search(text):
+            continue
+        matched.append(intent)
+    if "SystemMessage" in matched and "Proceed" in matched:
+        return None
+    return matched[0] if matched else None
+
+
+# Method to normalise the answer of get_email_intent to one of INTENTS
+def _parse_llm_intent(response):
+    answer = (response or "").strip().strip('"\'` .').lower()
+    for intent in INTENTS:
+        if answer == intent.lower():
+            return intent
+    return None
+
+
+class IntentClassifier:
+
+    def __init__(self, examples, min_confidence=MIN_CONFIDENCE, llm=get_email_intent):
+        self.min_confidence = min_confidence
+        self.llm = llm
+        self.model = NaiveBayesIntentModel().fit(examples)
+        self.training_accuracy = calibrate(self.model, examples)
+        self._lock = threading.Lock()
+        self._sources = Counter()
+        self._intents = Counter()
+        # Local predictions of the emails sent to Gen AI, scored against its answer
+        self._llm_checked = Counter()
+        self._llm_agreed = Counter()
+
+    # Method to classify an email. Returns the intent, its confidence and what decided it
+    # ("rules", "model", or "llm").
+    def classify(self, text):
+        intent = match_rules(text)
+        if intent is not None:
+            result = (intent, 1.0, "rules")
+        else:
+            intent, confidence = self.model.predict(text)
+            result = (intent, confidence, "model")
+            if confidence < self.min_confidence and self.llm is not None:
+                result = self._ask_llm(text, intent, confidence) or result
+
+        with self._lock:
+            self._sources[result[2]] += 1
+            self._intents[result[0]] += 1
+        return result
+
+    def _ask_llm(self, text, local_intent, local_confidence):
+        try:
+            intent = _parse_llm_intent(self.llm(text))
+        except Exception as e:
+            logger.warning("Gen AI intent classification failed: %s", e)
+            return None
+        if intent is None:
+            return None
+
+        with self._lock:
+            self._llm_checked[intent] += 1
+            if intent == local_intent:
+                self._llm_agreed[intent] += 1
+        return intent, max(local_confidence, self.min_confidence), "llm"
+
+    def stats(self):
+        with self._lock:
+            total = sum(self._sources.values())
+            result = {
+                "classified": total,
+                "rules": self._sources["rules"],
+                "model": self._sources["model"],
+                "llm": self._sources["llm"],
+                "llm_fallback_rate": round(self._sources["llm"] / total, 4) if total else 0.0,
+            }
+            for intent in INTENTS:
+                result[f"predicted_{intent}"] = self._intents[intent]
+                if self.training_accuracy[intent] is not None:
+                    result[f"training_accuracy_{intent}"] = self.training_accuracy[intent]
+                if self._llm_checked[intent]:
+                    result[f"llm_agreement_{intent}"] = round(self._llm_agreed[intent] / self._llm_checked[intent], 4)
+        return result
+
+
+intent_classifier = IntentClassifier(_load_examples())
+
+
+def classify_intent(text):
+    return intent_classifier.classify(text)
+
+
+def stats():
+    return intent_classifier.stats()
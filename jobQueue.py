@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import requests
+from datetime import timedelta
+from urllib.parse import urlparse
+from dbOperations import RETENTION_DAYS, get_connection
+
+logger = logging.getLogger(__name__)
+
+
+JOBS_DB_NAME = os.getenv("jobs_db", "claimJobs.db")
+
+JOB_WORKERS = int(os.getenv("job_workers", "4"))
+POLL_INTERVAL = float(os.getenv("job_poll_interval", "2"))
+WEBHOOK_TIMEOUT = float(os.getenv("job_webhook_timeout", "10"))
+# Hosts job results may be posted to, comma separated. Callbacks are refused when empty.
+CALLBACK_HOSTS = {h.strip().lower() for h in os.getenv("job_callback_hosts", "").split(",") if h.strip()}
+
+_job_available = threading.Event()
+_workers = []
+_stopping = threading.Event()
+
+
+def init_job_db():
+
+    conn = get_connection(JOBS_DB_NAME)
+    c = conn.cursor()
+    c.execute('PRAGMA journal_mode = WAL')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            conversation_id TEXT,
+            body TEXT,
+            callback_url TEXT,
+            status TEXT,
+            status_code INTEGER,
+            result TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)')
+
+    # Jobs that were running when the process stopped are picked up again
+    c.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+    conn.commit()
+
+
+# Method to persist a new job and wake up a worker
+def enqueue_job(conversation_id, body, callback_url=None):
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = get_connection(JOBS_DB_NAME)
+    with conn:
+        conn.execute('''
+            INSERT INTO jobs (job_id, conversation_id, body, callback_url, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'queued', ?, ?)
+        ''', (job_id, conversation_id, body, callback_url, now, now))
+    _job_available.set()
+    return job_id
+
+
+# Method to take the oldest queued job, marking it as running in the same transaction
+def claim_next_job():
+    conn = get_connection(JOBS_DB_NAME)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('''
+            SELECT job_id, conversation_id, body, callback_url FROM jobs
+            WHERE status = 'queued' ORDER BY created_at LIMIT 1
+        ''').fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE job_id = ?", (time.time(), row[0]))
+
+    return {"job_id": row[0], "conversation_id": row[1], "body": row[2], "callback_url": row[3]}
+
+
+# Method to store the result of a finished job. The body is dropped, it is not needed any more.
+def complete_job(job_id, result, status_code, status="done"):
+    conn = get_connection(JOBS_DB_NAME)
+    with conn:
+        conn.execute('''
+            UPDATE jobs SET status = ?, status_code = ?, result = ?, body = NULL, updated_at = ?
+            WHERE job_id = ?
+        ''', (status, status_code, json.dumps(result), time.time(), job_id))
+
+
+# Method to retrieve a job by its ID
+def get_job(job_id):
+    row = get_connection(JOBS_DB_NAME).execute('''
+        SELECT job_id, conversation_id, status, status_code, result, created_at, updated_at
+        FROM jobs WHERE job_id = ?
+    ''', (job_id,)).fetchone()
+    if not row:
+        return None
+
+    return {
+        "jobId": row[0],
+        "ConversationID": row[1],
+        "status": row[2],
+        "statusCode": row[3],
+        "result": json.loads(row[4]) if row[4] else None,
+        "createdAt": row[5],
+        "updatedAt": row[6],
+    }
+
+
+# Method to check a callback URL is http(s) and points to one of the configured callback hosts
+def is_allowed_callback(callback_url):
+    try:
+        parsed = urlparse(callback_url)
+        hostname = parsed.hostname
+    except ValueError:
+        return False
+    return parsed.scheme in ("http", "https") and bool(hostname) and hostname.lower() in CALLBACK_HOSTS
+
+
+# Method to delete finished jobs older than the conversation retention period. Returns the number removed.
+def prune_jobs(retention_days=None):
+    retention_days = RETENTION_DAYS if retention_days is None else retention_days
+    if retention_days <= 0:
+        return 0
+    cutoff = time.time() - timedelta(days=retention_days).total_seconds()
+    conn = get_connection(JOBS_DB_NAME)
+    with conn:
+        return conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+        ).rowcount
+
+
+# Method to post the job result to the callback URL given with the request
+def send_webhook(callback_url, job):
+    if not is_allowed_callback(callback_url):
+        logger.warning("Webhook for job %s not sent, callback host is not allowed", job["jobId"])
+        return
+    try:
+        # Redirects are not followed, they could lead to a host outside the allowlist
+        response = requests.post(callback_url, json=job, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+        logger.debug("Webhook for job %s responded with status code: %s", job["jobId"], response.status_code)
+    except requests.exceptions.RequestException as e:
+        logger.error("Webhook for job %s failed: %s", job["jobId"], e)
+
+
+def _run_worker(handler):
+    while not _stopping.is_set():
+        try:
+            job = claim_next_job()
+        except Exception as e:
+            logger.error("Could not read the job queue: %s", e)
+            job = None
+
+        if job is None:
+            _job_available.wait(POLL_INTERVAL)
+            _job_available.clear()
+            continue
+
+        try:
+            result, status_code = handler(job["conversation_id"], job["body"] or "")
+            complete_job(job["job_id"], result, status_code)
+        except Exception as e:
+            complete_job(job["job_id"], {
+                "error": "Exception occurred during claim creation",
+                "message": str(e)
+            }, 500, status="failed")
+
+        if job["callback_url"]:
+            send_webhook(job["callback_url"], get_job(job["job_id"]))
+
+
+# Method to start the background workers. handler(conversation_id, body) returns (result, status_code).
+def start_job_workers(handler, count=JOB_WORKERS):
+    if _workers or count <= 0:
+        return
+
+    _stopping.clear()
+    for i in range(count):
+        worker = threading.Thread(target=_run_worker, args=(handler,), name=f"job-worker-{i}", daemon=True)
+        worker.start()
+        _workers.append(worker)
+
+
+# Method to stop the workers after the jobs they are running have finished
+def stop_job_workers(timeout=None):
+    _stopping.set()
+    _job_available.set()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
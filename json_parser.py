@@ -0,0 +1,96 @@
+import json
+import re
+import threading
+
+# Tolerant parsing of JSON returned by Gen AI: code fences, text around the object, trailing
+# commas and output cut off before the closing brackets are accepted
+
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*$", re.MULTILINE)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+_decoder = json.JSONDecoder()
+
+_stats = {"parsed": 0, "recovered": 0, "failures": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+# Method to close the strings, objects and arrays left open in a truncated document
+def _close_open(text):
+    stack = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    # A key without its value can not be completed
+    if text.endswith(":"):
+        text += " null"
+    return text + "".join(reversed(stack))
+
+
+def _decode_from(text, start):
+    for candidate in (text[start:], _TRAILING_COMMA.sub(r"\1", text[start:])):
+        try:
+            return _decoder.raw_decode(candidate)[0]
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+# Method to parse the first JSON object or array in a Gen AI response. Returns None when there is none.
+def parse_json_response(text):
+    if not text:
+        _count("failures")
+        return None
+
+    try:
+        value = json.loads(text)
+        _count("parsed")
+        return value
+    except (TypeError, json.JSONDecodeError):
+        pass
+
+    text = _FENCE.sub("", str(text))
+    starts = [match.start() for match in re.finditer(r"[{\[]", text)]
+    for start in starts:
+        value = _decode_from(text, start)
+        if isinstance(value, (dict, list)):
+            _count("recovered")
+            return value
+
+    # No complete document, the output was probably cut off
+    if starts:
+        try:
+            value = json.loads(_TRAILING_COMMA.sub(r"\1", _close_open(text[starts[0]:])))
+            _count("recovered")
+            return value
+        except json.JSONDecodeError:
+            pass
+
+    _count("failures")
+    return None
+
+
+def parse_stats():
+    with _stats_lock:
+        return dict(_stats)
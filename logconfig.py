@@ -0,0 +1,130 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+# Logging setup shared by every module. Records are formatted lazily, filtered by per-module
+# levels and written by a background thread, so a disabled debug call costs only a level check
+# and an enabled one never waits on stdout.
+#
+#   log_level=INFO                          level of the root logger
+#   log_levels=verify=DEBUG,cache=WARNING   levels per module
+#   log_format=json|text
+
+load_dotenv()
+
+# Conversation being processed by the current thread, added to every record
+conversation_id_var = contextvars.ContextVar("conversation_id", default=None)
+
+_listener = None
+_lock = threading.Lock()
+_traceback_formatter = logging.Formatter()
+
+
+class ContextFilter(logging.Filter):
+
+    def filter(self, record):
+        record.conversation_id = conversation_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "conversationId": getattr(record, "conversation_id", None),
+            "thread": record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+# Queue handler that keeps the traceback apart from the message. The base class formats the whole
+# record, traceback included, into the message on the calling thread.
+class ContextQueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(conversation_id)s] %(message)s")
+
+    def format(self, record):
+        if not hasattr(record, "conversation_id"):
+            record.conversation_id = None
+        return super().format(record)
+
+
+def _parse_levels(value):
+    levels = {}
+    for item in (value or "").split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+# Method to install the queue handler on the root logger and start the writer thread. Safe to call more than once.
+def configure_logging():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter() if os.getenv("log_format", "json") == "json" else TextFormatter())
+
+        # The record is prepared (message merged with its arguments, traceback rendered) by the calling
+        # thread, only the serialization and the write happen on the listener thread
+        records = queue.SimpleQueue()
+        queue_handler = ContextQueueHandler(records)
+        queue_handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        root.handlers = [queue_handler]
+        root.setLevel(os.getenv("log_level", "INFO").upper())
+        for name, level in _parse_levels(os.getenv("log_levels")).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+# Method to write the records still queued and stop the writer thread
+def stop_logging():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+# Method to submit a function to an executor with the logging context of the caller
+def submit_with_context(executor, fn, *args, **kwargs):
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -1,9 +1,15 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
+import logging
 import os
 import requests
 import time
 import random
+from cache import prompt_cache
+from policy_parser import estimate_tokens
+from ratelimit import gemini_limiter
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,6 +18,32 @@ api_key = os.getenv("gemini_token")
 # Configure Gemini
 genai.configure(api_key=api_key)
 
+MODEL_NAME = "gemini-2.0-flash"
+
+# Quota and overload errors returned by the API
+THROTTLE_MARKERS = ("429", "503", "UNAVAILABLE", "RESOURCE_EXHAUSTED")
+
+RESPONSE_TOKEN_ALLOWANCE = int(os.getenv("gemini_response_token_allowance", "1024"))
+
+
+def _generate_content(prompt, generation_config):
+    model = genai.GenerativeModel(MODEL_NAME)
+    return model.generate_content(
+        contents=prompt,
+        generation_config=genai.types.GenerationConfig(**generation_config)
+    )
+
+
+def _generation_config(temperature, response_schema):
+    generation_config = {"temperature": temperature}
+
+    # JSON mode: the response is constrained to the schema instead of free text
+    if response_schema is not None:
+        generation_config["response_mime_type"] = "application/json"
+        generation_config["response_schema"] = response_schema
+    return generation_config
+
+
 def get_ai_content(
     prompt,
     max_retries=3,
@@ -19,35 +51,55 @@ def get_ai_content(
     temperature=0.0,
     top_p=0.95,
     top_k=40,
-    
+    use_cache=True,
+    response_schema=None,
 ):
+    generation_config = _generation_config(temperature, response_schema)
+
+    # Responses are deterministic at temperature 0.0, so a repeated prompt can be served from the cache
+    cache_key = prompt_cache.make_key(MODEL_NAME, generation_config, prompt)
+    if use_cache:
+        cached = prompt_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # Prompt tokens plus an allowance for the response, corrected with the actual usage afterwards
+    estimated_tokens = estimate_tokens(prompt) + RESPONSE_TOKEN_ALLOWANCE
     retry_count = 0
 
     while retry_count <= max_retries:
-        try:
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            response = model.generate_content(
-                contents=prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperature
-                )
-            )
-
-            content_text = response.candidates[0].content.parts[0].text
-
-            return content_text
-
-        except Exception as e:
-            error_message = str(e)
-            
-
-            if "503" in error_message or "UNAVAILABLE" in error_message.upper():
-                retry_count += 1
-                delay = base_delay * (2 ** (retry_count - 1)) + random.uniform(0, 1)
-                print(f"Retrying in {delay:.2f} seconds...")
-                time.sleep(delay)
-            else:
-                break
-
-    
-    return None
\ No newline at end of file
+        throttled = False
+        with gemini_limiter.slot(estimated_tokens):
+            try:
+                response = _generate_content(prompt, generation_config)
+                content_text = response.candidates[0].content.parts[0].text
+
+                usage = getattr(response, "usage_metadata", None)
+                gemini_limiter.record_success(estimated_tokens, getattr(usage, "total_token_count", None))
+
+                if content_text:
+                    prompt_cache.set(cache_key, content_text)
+
+                return content_text
+
+            except Exception as e:
+                error_message = str(e).upper()
+                if not any(marker in error_message for marker in THROTTLE_MARKERS):
+                    break
+                throttled = True
+                gemini_limiter.record_throttled()
+
+        # The slot is released before sleeping; the lowered concurrency limit is what slows
+        # the other callers down, this delay only spaces out the retries of this call
+        if throttled:
+            retry_count += 1
+            delay = base_delay * (2 ** (retry_count - 1)) + random.uniform(0, 1)
+            logger.warning("Gemini call throttled, retrying in %.2f seconds", delay)
+            time.sleep(delay)
+
+    return None
+
+
+# Method to drop the cached response of a prompt, for responses that turned out to be unusable
+def invalidate_ai_content(prompt, temperature=0.0, response_schema=None):
+    prompt_cache.invalidate(prompt_cache.make_key(MODEL_NAME, _generation_config(temperature, response_schema), prompt))
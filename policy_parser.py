@@ -0,0 +1,230 @@
+import io
+import json
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+# Single pass parsing of the PolicyCenter policy period payload into a compact PolicySnapshot
+
+ADDRESS_CONTAINERS = ("PolicyAddress", "PrimaryAddress")
+ADDRESS_FIELDS = ("AddressLine1", "AddressLine2", "City", "State", "PostalCode", "Country")
+VEHICLE_FIELDS = ("Vin", "VIN", "Make", "Model", "Year", "LicensePlate", "PublicID")
+
+
+# Compact, parsed view of a policy period shared by every step of the pipeline
+class PolicySnapshot:
+    __slots__ = ("policy_number", "policy_type", "effective_date", "expiration_date", "coverages", "address", "vehicles")
+
+    def __init__(self, policy_number=None, policy_type=None, effective_date=None, expiration_date=None, coverages=None,
+                 address=None, vehicles=None):
+        self.policy_number = policy_number
+        self.policy_type = policy_type
+        self.effective_date = effective_date
+        self.expiration_date = expiration_date
+        self.coverages = coverages if coverages is not None else []
+        self.address = address
+        self.vehicles = vehicles if vehicles is not None else []
+
+    def to_dict(self):
+        return {
+            "PolicyNumber": self.policy_number,
+            "PolicyType": self.policy_type,
+            "EffectiveDate": self.effective_date.isoformat() if self.effective_date else None,
+            "ExpirationDate": self.expiration_date.isoformat() if self.expiration_date else None,
+            "Coverages": self.coverages,
+            "Address": self.address,
+            "Vehicles": self.vehicles,
+        }
+
+    def __repr__(self):
+        return f"PolicySnapshot({self.policy_number!r}, {self.policy_type!r}, {self.effective_date}, {self.expiration_date}, {len(self.coverages)} coverages)"
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _text(elem):
+    return elem.text.strip() if elem.text and elem.text.strip() else None
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+
+
+# Method to get the XML string out of the PolicyCenter response, which is either raw XML or a JSON list of XML strings
+def get_policy_xml(policy_details):
+    if policy_details.strip().startswith("["):
+        return json.loads(policy_details)[0]
+    return policy_details
+
+
+# Method to read one coverage from an Entry element of a *Coverages container
+def _parse_coverage(entry):
+    coverage = {}
+    for child in entry:
+        name = _local_name(child.tag)
+        if len(child):
+            # Pattern nested as <Pattern><Code/><Name/></Pattern>
+            if "Pattern" in name:
+                for field in child:
+                    field_name = _local_name(field.tag)
+                    text = _text(field)
+                    if not text:
+                        continue
+                    if field_name in ("Code", "CodeIdentifier", "PatternCode"):
+                        coverage.setdefault("PatternCode", text)
+                    elif field_name in ("DisplayName", "Name", "Description"):
+                        coverage.setdefault("Name", text)
+            continue
+        text = _text(child)
+        if not text:
+            continue
+        if name == "PublicID":
+            coverage["PublicID"] = text
+        elif name in ("PatternCode", "Pattern"):
+            coverage["PatternCode"] = text
+        elif name in ("DisplayName", "Name", "Description"):
+            coverage.setdefault("Name", text)
+        elif name.endswith("CoverageType") or name == "CovType":
+            coverage["CoverageType"] = text
+    return coverage
+
+
+# Method to read the leaf children of an element whose names are in fields
+def _read_fields(elem, fields):
+    values = {}
+    for child in elem:
+        name = _local_name(child.tag)
+        text = _text(child)
+        if text and name in fields:
+            values["Vin" if name == "VIN" else name] = text
+    return values
+
+
+# Method to parse the policy details in one pass. When the details (coverages, address and
+# vehicles) are not needed the parse stops as soon as the number, type and both dates have been read.
+def parse_policy(policy_details, with_details=True):
+    if isinstance(policy_details, PolicySnapshot):
+        return policy_details
+
+    xml_string = get_policy_xml(policy_details)
+    source = io.BytesIO(xml_string.encode("utf-8") if isinstance(xml_string, str) else xml_string)
+
+    snapshot = PolicySnapshot()
+    # Number of *Coverages and *Vehicles containers open around the current element
+    open_details = 0
+
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        name = _local_name(elem.tag)
+        is_details = name.endswith("Coverages") or name.endswith("Vehicles")
+
+        if event == "start":
+            if is_details:
+                open_details += 1
+            continue
+
+        if is_details:
+            open_details -= 1
+
+        if len(elem):
+            if with_details:
+                if name.endswith("Coverages"):
+                    for entry in elem:
+                        if _local_name(entry.tag) == "Entry":
+                            coverage = _parse_coverage(entry)
+                            if coverage:
+                                snapshot.coverages.append(coverage)
+                elif name.endswith("Vehicles"):
+                    for entry in elem:
+                        vehicle = _read_fields(entry, VEHICLE_FIELDS)
+                        if vehicle:
+                            snapshot.vehicles.append(vehicle)
+                elif name in ADDRESS_CONTAINERS and snapshot.address is None:
+                    snapshot.address = _read_fields(elem, ADDRESS_FIELDS) or None
+
+            # Containers are released once their content has been read. Entries, and everything
+            # inside a *Coverages or *Vehicles container, are kept until that container ends,
+            # leaves until their parent ends.
+            if name != "Entry" and not open_details:
+                elem.clear()
+            continue
+
+        text = _text(elem)
+        if name == "PeriodEnd" and snapshot.expiration_date is None:
+            snapshot.expiration_date = _parse_datetime(text)
+        elif name == "OriginalEffectiveDate" and snapshot.effective_date is None:
+            snapshot.effective_date = _parse_datetime(text)
+        elif name == "PolicyNumber" and snapshot.policy_number is None:
+            snapshot.policy_number = text
+        elif name.endswith("PolicyType") and snapshot.policy_type is None:
+            snapshot.policy_type = text
+        else:
+            continue
+
+        if not with_details and None not in (
+            snapshot.policy_number, snapshot.policy_type, snapshot.effective_date, snapshot.expiration_date
+        ):
+            break
+
+    return snapshot
+
+
+# Rough token estimate used to report prompt savings, about four characters per token
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+_context_stats = {"requests": 0, "raw_tokens": 0, "compact_tokens": 0, "raw_fallbacks": 0}
+_context_stats_lock = threading.Lock()
+
+
+# Method to render the fields the claim prompt needs from the policy as compact JSON.
+# Falls back to the raw payload when no coverages could be read from it.
+# Returns the context text along with the estimated raw and compact token counts.
+def build_policy_context(policy_details, snapshot=None):
+    raw_tokens = estimate_tokens(policy_details) if isinstance(policy_details, str) else None
+    snapshot = snapshot or parse_policy(policy_details)
+
+    if not snapshot.coverages and isinstance(policy_details, str):
+        with _context_stats_lock:
+            _context_stats["requests"] += 1
+            _context_stats["raw_fallbacks"] += 1
+            _context_stats["raw_tokens"] += raw_tokens
+            _context_stats["compact_tokens"] += raw_tokens
+        return policy_details, raw_tokens, raw_tokens
+
+    context = {
+        "PolicyNumber": snapshot.policy_number,
+        "PolicyType": snapshot.policy_type,
+        "EffectiveDate": snapshot.effective_date.isoformat() if snapshot.effective_date else None,
+        "ExpirationDate": snapshot.expiration_date.isoformat() if snapshot.expiration_date else None,
+        "InsuredAddress": snapshot.address,
+        "Vehicles": snapshot.vehicles,
+        "coverages": [
+            {
+                "Coverage": coverage.get("Name") or coverage.get("PatternCode"),
+                "CoverageType": coverage.get("CoverageType") or coverage.get("PatternCode"),
+                "public id": coverage.get("PublicID"),
+            }
+            for coverage in snapshot.coverages
+        ],
+    }
+    context = json.dumps({k: v for k, v in context.items() if v}, separators=(",", ":"))
+    compact_tokens = estimate_tokens(context)
+
+    with _context_stats_lock:
+        _context_stats["requests"] += 1
+        _context_stats["raw_tokens"] += raw_tokens or compact_tokens
+        _context_stats["compact_tokens"] += compact_tokens
+
+    return context, raw_tokens, compact_tokens
+
+
+def context_stats():
+    with _context_stats_lock:
+        result = dict(_context_stats)
+    result["saved_tokens"] = result["raw_tokens"] - result["compact_tokens"]
+    return result
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from metrics import registry
+
+# Client side quota for the Gemini API: request and token buckets refilled per minute,
+# in front of a concurrency limit that adapts to 429/503 responses (additive increase,
+# multiplicative decrease)
+
+load_dotenv()
+
+queue_wait = registry.histogram(
+    "gemini_queue_wait_seconds", "Time a Gemini call waited for the rate limiter",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+
+class TokenBucket:
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # Method to take amount tokens, waiting until the bucket has them. Requests larger than the
+    # capacity are allowed once the bucket is full, otherwise they would never get through.
+    def acquire(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+    # Method to charge tokens used beyond the estimate, the bucket may go into debt
+    def charge(self, amount):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class AdaptiveConcurrencyLimit:
+
+    def __init__(self, initial, minimum=1, maximum=64, backoff_ratio=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff_ratio = backoff_ratio
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._in_flight = 0
+        # Calls are numbered as they start; overloads of calls that started before the last
+        # decrease belong to the same overload event and do not decrease the limit again
+        self._started = 0
+        self._decreased_at = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    # Method to wait for a free slot. Returns the number of the call, passed back to on_overload.
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+            self._started += 1
+            return self._started
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    # A full window of successes grows the limit by one
+    def on_success(self):
+        with self._condition:
+            previous = int(self._limit)
+            self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+            if int(self._limit) > previous:
+                self._condition.notify()
+
+    # Decreases the limit at most once per overload event: only a call started after the last
+    # decrease can decrease it again
+    def on_overload(self, call=None):
+        with self._condition:
+            if call is not None and call <= self._decreased_at:
+                return
+            self._limit = max(self.minimum, self._limit * self.backoff_ratio)
+            self._decreased_at = self._started
+
+
+class RateLimiter:
+
+    def __init__(self, requests_per_minute, tokens_per_minute, initial_concurrency, max_concurrency):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrencyLimit(initial_concurrency, maximum=max_concurrency)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"calls": 0, "throttled": 0, "queue_wait_total": 0.0, "queue_wait_max": 0.0}
+
+    # Context manager holding a slot for one call. Yields the time spent waiting for it.
+    @contextmanager
+    def slot(self, estimated_tokens):
+        start = time.monotonic()
+        self._local.call = self.concurrency.acquire()
+        try:
+            self.requests.acquire()
+            self.tokens.acquire(estimated_tokens)
+            wait = time.monotonic() - start
+            queue_wait.observe(wait)
+            with self._lock:
+                self._stats["calls"] += 1
+                self._stats["queue_wait_total"] += wait
+                self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], wait)
+            yield wait
+        finally:
+            self.concurrency.release()
+            self._local.call = None
+
+    def record_success(self, estimated_tokens, used_tokens=None):
+        if used_tokens is not None and used_tokens > estimated_tokens:
+            self.tokens.charge(used_tokens - estimated_tokens)
+        self.concurrency.on_success()
+
+    def record_throttled(self):
+        with self._lock:
+            self._stats["throttled"] += 1
+        self.concurrency.on_overload(getattr(self._local, "call", None))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_wait_avg"] = stats["queue_wait_total"] / stats["calls"] if stats["calls"] else 0.0
+        stats["concurrency_limit"] = self.concurrency.limit
+        stats["in_flight"] = self.concurrency.in_flight
+        stats["requests_available"] = int(self.requests.available())
+        stats["tokens_available"] = int(self.tokens.available())
+        return stats
+
+
+gemini_limiter = RateLimiter(
+    requests_per_minute=int(os.getenv("gemini_rpm", "2000")),
+    tokens_per_minute=int(os.getenv("gemini_tpm", "4000000")),
+    initial_concurrency=int(os.getenv("gemini_initial_concurrency", "8")),
+    max_concurrency=int(os.getenv("gemini_max_concurrency", "32"))
+)
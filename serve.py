@@ -0,0 +1,142 @@
+import _thread
+import logging
+import os
+import signal
+import threading
+import time
+from dotenv import load_dotenv
+from waitress import create_server
+
+import api
+import guidewire
+from dbOperations import close_connection
+from jobQueue import stop_job_workers
+from logconfig import stop_logging
+
+# Production entry point: serves the Flask app with waitress, a multi-threaded WSGI server that
+# also runs on Windows. Requests spend most of their time waiting on Gen AI and Guidewire, so
+# the thread count, not the CPU count, sets how many claims one node holds in flight.
+#
+#   python serve.py
+#
+# intake_workers and gw_pool_maxsize default to 2 x and 1 x serve_threads; smaller values are
+# reported at startup since the extra threads would only wait for them.
+#
+# On SIGTERM/SIGINT /healthz starts failing, requests already accepted are allowed to finish
+# (up to serve_shutdown_timeout seconds) and the background workers are stopped before exit.
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HOST = os.getenv("serve_host", "0.0.0.0")
+PORT = int(os.getenv("serve_port", "5000"))
+THREADS = int(os.getenv("serve_threads", "200"))
+CONNECTION_LIMIT = int(os.getenv("serve_connection_limit", "1000"))
+CHANNEL_TIMEOUT = int(os.getenv("serve_channel_timeout", "300"))
+# Time for load balancers to notice the failing readiness probe before draining starts
+SHUTDOWN_DELAY = float(os.getenv("serve_shutdown_delay", "0"))
+SHUTDOWN_TIMEOUT = float(os.getenv("serve_shutdown_timeout", "120"))
+
+
+# WSGI middleware counting the requests whose response has not been fully sent yet
+class InFlightTracker:
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._condition = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._condition:
+            self.count += 1
+        try:
+            return _TrackedResponse(self.app(environ, start_response), self._done)
+        except BaseException:
+            self._done()
+            raise
+
+    def _done(self):
+        with self._condition:
+            self.count -= 1
+            self._condition.notify_all()
+
+    # Method to wait until every request has finished, returns False on timeout
+    def wait_idle(self, timeout):
+        with self._condition:
+            return self._condition.wait_for(lambda: self.count <= 0, timeout)
+
+
+class _TrackedResponse:
+
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, "close"):
+                self.iterable.close()
+        finally:
+            self.on_close()
+
+
+# Method to warn when the pools behind the server threads are too small to keep them all busy
+def check_pool_sizes():
+    if api.INTAKE_WORKERS < 2 * THREADS:
+        logger.warning("intake_workers=%d is below 2 x serve_threads=%d, Guidewire calls will queue",
+                       api.INTAKE_WORKERS, 2 * THREADS)
+    if guidewire.POOL_MAXSIZE < THREADS:
+        logger.warning("gw_pool_maxsize=%d is below serve_threads=%d, Guidewire calls will queue",
+                       guidewire.POOL_MAXSIZE, THREADS)
+
+
+def main():
+    check_pool_sizes()
+    tracker = InFlightTracker(api.app)
+    server = create_server(
+        tracker,
+        host=HOST,
+        port=PORT,
+        threads=THREADS,
+        connection_limit=CONNECTION_LIMIT,
+        channel_timeout=CHANNEL_TIMEOUT,
+        ident="claim-intake",
+    )
+
+    def drain():
+        time.sleep(SHUTDOWN_DELAY)
+        if not tracker.wait_idle(SHUTDOWN_TIMEOUT):
+            logger.error("%d requests still running after %s seconds, stopping anyway", tracker.count, SHUTDOWN_TIMEOUT)
+        # Leave the server loop a moment to send the last responses
+        time.sleep(0.5)
+        _thread.interrupt_main()
+
+    def on_signal(signum, frame):
+        if api.shutting_down.is_set():
+            raise KeyboardInterrupt
+        logger.info("Received signal %s, draining %d in-flight requests", signum, tracker.count)
+        api.shutting_down.set()
+        threading.Thread(target=drain, name="shutdown-drain", daemon=True).start()
+
+    for name in ("SIGTERM", "SIGINT", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), on_signal)
+
+    logger.info("Serving on http://%s:%d with %d threads", HOST, PORT, THREADS)
+    try:
+        server.run()
+    finally:
+        server.close()
+        stop_job_workers(timeout=SHUTDOWN_TIMEOUT)
+        guidewire.close()
+        close_connection()
+        logger.info("Server stopped")
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
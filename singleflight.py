@@ -0,0 +1,37 @@
+import threading
+from concurrent.futures import Future
+
+
+# Coalesces concurrent calls with the same key: the first caller runs the function,
+# the others wait for it and get the same result (or exception)
+class SingleFlight:
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+
+        return future.result()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,76 @@
+import pytest
+
+import extractor
+from extractor import MIN_CONFIDENCE, extract_fields, extract_loss_date, extract_policy_number, try_fast_path
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Loss date: 2025-07-22", "2025-07-22T00:00:00.000Z"),
+    ("Loss date: 2025-07-22T22:30:00Z", "2025-07-22T22:30:00.000Z"),
+    ("Loss date: 2025/07/22 22:30", "2025-07-22T22:30:00.000Z"),
+    ("Loss date: 07/22/2025", "2025-07-22T00:00:00.000Z"),
+    ("Loss date: 22.07.2025", "2025-07-22T00:00:00.000Z"),
+    ("Loss date: July 22, 2025 at 10:30 PM", "2025-07-22T22:30:00.000Z"),
+    ("Loss date: Jul 22nd 2025 @ 9am", "2025-07-22T09:00:00.000Z"),
+    ("Loss date: 22nd of July, 2025, 14:05", "2025-07-22T14:05:00.000Z"),
+    ("Loss date: 22-Jul-2025", "2025-07-22T00:00:00.000Z"),
+    ("The accident happened on 07/22/2025 around 3pm", "2025-07-22T15:00:00.000Z"),
+    ("It happened at 9:15 am on 22 July 2025", "2025-07-22T09:15:00.000Z"),
+])
+def test_date_formats(text, expected):
+    value, confidence = extract_loss_date(text)
+    assert extractor.format_loss_date(value) == expected
+    assert confidence >= MIN_CONFIDENCE
+
+
+def test_ambiguous_day_month_order_is_low_confidence():
+    value, confidence = extract_loss_date("Loss date: 03/04/2025")
+    assert (value.month, value.day) == (3, 4)
+    assert confidence < MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("text", [
+    "My policy no: 5551234, accident happened on 07/22/2025 in the evening",
+    "My policy no: 5551234, accident happened on 07/22/2025 late at night",
+    "My policy no: 5551234, loss date 22/07/2025 at 25:00",
+])
+def test_unreadable_time_is_left_to_gen_ai(text):
+    policy_number, loss_date, confidence = extract_fields(text)
+    assert policy_number == "5551234"
+    assert confidence < MIN_CONFIDENCE
+
+
+def test_future_date_is_low_confidence():
+    assert extract_loss_date("Loss date: July 22, 2999")[1] < MIN_CONFIDENCE
+
+
+def test_conflicting_dates_are_not_guessed():
+    assert extract_loss_date("It was on 2025-07-01 or maybe 2025-07-03") == (None, 0.0)
+
+
+def test_labelled_date_wins_over_other_dates():
+    value, _ = extract_loss_date("Sent 2025-08-01. Loss date: 2025-07-22")
+    assert value.day == 22
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Policy number: 1234567", ("1234567", 0.95)),
+    ("policy # 1234567", ("1234567", 0.95)),
+    ("Reference 1234567", ("1234567", 0.6)),
+    ("Policy 1234567 and policy 7654321", (None, 0.0)),
+    ("No numbers here", (None, 0.0)),
+])
+def test_policy_number_confidence(text, expected):
+    assert extract_policy_number(text) == expected
+
+
+def test_hit_counter():
+    before = extractor.stats()
+    assert try_fast_path("Policy number 1234567, loss date: July 22, 2025 at 10:30 PM") == (
+        "1234567", "2025-07-22T22:30:00.000Z"
+    )
+    assert try_fast_path("My car was hit yesterday") == (None, None)
+    after = extractor.stats()
+    assert after["attempts"] - before["attempts"] == 2
+    assert after["hits"] - before["hits"] == 1
+    assert after["fallbacks"] - before["fallbacks"] == 1
@@ -0,0 +1,72 @@
+import pytest
+
+from intent import EXAMPLES, IntentClassifier, match_rules
+
+
+@pytest.fixture
+def classifier():
+    llm_calls = []
+
+    def llm(text):
+        llm_calls.append(text)
+        return "Acknowledge"
+
+    classifier = IntentClassifier(EXAMPLES, min_confidence=0.75, llm=llm)
+    classifier.llm_calls = llm_calls
+    return classifier
+
+
+@pytest.mark.parametrize("text", [
+    "Thank you. Proceed.",
+    "Thanks, please proceed with the claim.",
+    "Thank you for letting me know, but please go ahead and file it.",
+    "Got it, thanks. I want to file this claim anyway.",
+])
+def test_thanks_and_proceed_is_proceed(classifier, text):
+    assert classifier.classify(text) == ("Proceed", 1.0, "rules")
+    assert classifier.llm_calls == []
+
+
+@pytest.mark.parametrize("text", [
+    "Thank you, please do not proceed.",
+    "Thanks, no need to file it again.",
+])
+def test_thanks_and_negated_proceed_is_acknowledge(classifier, text):
+    assert classifier.classify(text)[0] == "Acknowledge"
+
+
+@pytest.mark.parametrize("text", [
+    "Thanks for the status update. Please go ahead and file the claim.",
+    "Please proceed, I'm out of office next week",
+    "Please do not reply to the adjuster, just go ahead and file it.",
+])
+def test_customer_wording_does_not_make_a_system_message(classifier, text):
+    assert classifier.classify(text) == ("Proceed", 1.0, "rules")
+
+
+def test_automated_message_is_system_message(classifier):
+    text = "This is an automated message, please do not reply to this email."
+    assert classifier.classify(text) == ("SystemMessage", 1.0, "rules")
+
+
+@pytest.mark.parametrize("text", [
+    "A possible duplicate claim was found. Reply proceed to file a new claim.",
+    "Claim Number: 000-00-004665 has been successfully registered. Please proceed if this is not a duplicate.",
+])
+def test_system_message_and_proceed_is_left_to_the_model(classifier, text):
+    assert match_rules(text) is None
+    intent, _, source = classifier.classify(text)
+    assert (intent, source) == ("SystemMessage", "model")
+
+
+def test_unsure_system_message_and_proceed_falls_back_to_llm(classifier):
+    text = "I got your email saying reply proceed, so: proceed."
+    assert classifier.classify(text)[2] == "llm"
+    assert classifier.llm_calls == [text]
+
+
+def test_unsure_model_falls_back_to_llm(classifier):
+    intent, _, source = classifier.classify("hmm")
+    assert (intent, source) == ("Acknowledge", "llm")
+    assert classifier.llm_calls == ["hmm"]
+    assert classifier.stats()["llm_fallback_rate"] == 1.0
@@ -1,8 +1,10 @@
-from logging import root
+import logging
 from model import get_ai_content
-import xml.etree.ElementTree as ET
+from policy_parser import parse_policy
+from metrics import timed
 from datetime import datetime, timezone, timedelta
-import json
+
+logger = logging.getLogger(__name__)
 
 
 def get_email_intent(body):
@@ -53,92 +55,38 @@ Return only one of these strings exactly:
 """
     
     response = get_ai_content(prompt)
-    print("Intent Response:", response)  
+    logger.debug("Intent response: %s", response)
     return response.strip()
 
 
 # Method to parse and verify if the policy is inforce or expired
 def verify_policy_details(policy_details):
     try:
-       
-        if policy_details.strip().startswith("["):
-            xml_list = json.loads(policy_details)
-            xml_string = xml_list[0]
-        else:
-            xml_string = policy_details
-
-       
-        ns = {'ns': 'http://guidewire.com/pc/gx/gw.webservice.pc.pc1000.gxmodel.policyperiodmodel'}
+        snapshot = parse_policy(policy_details, with_details=False)
 
-       
-        root = ET.fromstring(xml_string)
-        
-       
-        period_end = root.find('ns:PeriodEnd', ns)
-        if period_end is not None:
-            period_end_dt = datetime.fromisoformat(period_end.text.replace("Z", "+00:00"))
-            
-        else:
-            
+        period_end_dt = snapshot.expiration_date
+        if period_end_dt is None:
             return None, None, None, None
 
-        # Extract Effective Date
-        effective_date = root.find('ns:Policy/ns:OriginalEffectiveDate', ns)
-        if effective_date is not None:
-            effective_date_dt = datetime.fromisoformat(effective_date.text.replace("Z", "+00:00"))
-        else:
-            effective_date_dt = None
-
-        # Extract Policy Type
-        policy_type = None
-        for elem in root.iter():
-            if elem.tag.endswith("PolicyType"):
-                policy_type = elem.text
-                break
-
-        # Extract Policy Number
-        policy_number = root.find('ns:PolicyNumber', ns)
-        policy_number = policy_number.text if policy_number is not None else None
-
         # Today's date (UTC)
         today = datetime.now(timezone.utc)
         status = "Expired" if today > period_end_dt else "Inforce"
 
-        return status, policy_type
+        return status, snapshot.policy_type
 
     except Exception as e:
         return None, None
 
+@timed("verify_policy")
 def verify_policy(policy_details, loss_date_str):
     try:
-        
-        if policy_details.strip().startswith("["):
-            xml_list = json.loads(policy_details)
-            xml_string = xml_list[0]
-        else:
-            xml_string = policy_details
-
-        
-        ns = {'ns': 'http://guidewire.com/pc/gx/gw.webservice.pc.pc1000.gxmodel.policyperiodmodel'}
+        snapshot = parse_policy(policy_details, with_details=False)
 
-        
-        root = ET.fromstring(xml_string)
-        period_end = root.find('.//ns:PeriodEnd', ns)
-        if period_end is None:
+        exp_date = snapshot.expiration_date
+        if exp_date is None:
             return None, None, None, None
 
-        exp_date = datetime.fromisoformat(period_end.text.replace("Z", "+00:00"))
-        effective_date = root.find('.//ns:OriginalEffectiveDate', ns)
-        if effective_date is not None:
-            eff_date = datetime.fromisoformat(
-                effective_date.text.replace("Z", "+00:00")
-            )
-        else:
-            eff_date = None
-
-        print("Effective Date from Policy Details:", 
-              effective_date.text if effective_date is not None else None)
-        print("Expiration Date from Policy Details:", exp_date)
+        eff_date = snapshot.effective_date
 
 
         sub_date = datetime.now(timezone.utc)
@@ -148,10 +96,7 @@ def verify_policy(policy_details, loss_date_str):
 
         loss_date = datetime.fromisoformat(loss_date_str)
 
-        print("Submission Date (Current UTC):", sub_date)
-        print("Loss Date from Input:", loss_date)
-        print("Effective Date:", eff_date)
-        print("Expiration Date:", exp_date)
+        logger.debug("Policy period %s - %s, loss date %s, submission date %s", eff_date, exp_date, loss_date, sub_date)
 
         if loss_date > sub_date:
             return "PolicyInvalid"
@@ -180,7 +125,3 @@ def verify_policy(policy_details, loss_date_str):
 
     except Exception as e:
         return f"Error: {str(e)}"
-
-
-    except Exception as e:
-        return f"Error: {str(e)}"
\ No newline at end of file
@@ -1,102 +1,119 @@
-from datetime import datetime
+import logging
 import requests
 import json
+import guidewire
+from claim_index import claim_index, parse_claim_date
+from json_parser import parse_json_response
+from model import get_ai_content
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Function to refresh the local claim history of a policy from the claim details API.
+# Returns "Refreshed", "NoClaims" when the API does not return claims, or "Invalid" for an unreadable response.
+def refresh_claim_history(policy_number):
+    payload = {
+        "PolicyNumber": str(policy_number)
+    }
+    
+    logger.debug("Sending getClaimDetails request with payload: %s", payload)
+    
+    response = guidewire.post("getClaimDetails", json.dumps(payload))
+
+    logger.debug("API responded with status code: %s", response.status_code)
+
+    if response.status_code != 200:
+        return "NoClaims"
 
-# Function to validate claim based on policy number and loss date with a difference check
-def validate_claim(policy_number, loss_date, max_difference_hours=24):
     try:
-        print(f"[DEBUG] Starting claim validation for PolicyNumber: {policy_number} and LossDate: {loss_date}")
+        claim_data = response.json()
+        logger.debug("Parsed JSON response successfully.")
+    except json.JSONDecodeError:
+        logger.error("Failed to parse the getClaimDetails response.")
+        return "Invalid"
 
-        # API Endpoint & Headers
-        url = "http://18.218.57.115:8090/cc/rest/claimdetails/v1/getClaimDetails"
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': 'Basic c3U6Z3c='
-        }
-        payload = {
-            "PolicyNumber": str(policy_number)
-        }
-        
-        print(f"[DEBUG] Sending request to {url} with payload: {payload}")
-        
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=10)
+    if not isinstance(claim_data, list):
+        logger.error("Unexpected response format: expected a list of claims.")
+        return "Invalid"
 
-        print(f"[DEBUG] API responded with status code: {response.status_code}")
+    logger.debug("Number of claims received: %d", len(claim_data))
 
-        if response.status_code != 200:
-          latest_claim = {
-                            "Status": "New"
-                            }
-          return latest_claim
+    claim_index.merge(policy_number, claim_data)
+    return "Refreshed"
 
-        try:
-            claim_data = response.json()
-            print(f"[DEBUG] Parsed JSON response successfully.")
-        except json.JSONDecodeError:
-            print("[ERROR] Failed to parse JSON response.")
-            return None
 
-        if not isinstance(claim_data, list):
-            print("[ERROR] Unexpected response format: expected a list of claims.")
-            return None
+# Function to find the latest claim in the local index whose loss date is within max_difference_hours
+def find_latest_claim(policy_number, loss_date, max_difference_hours):
+    input_loss_time = parse_claim_date(loss_date).timestamp()
 
-        print(f"[DEBUG] Number of claims received: {len(claim_data)}")
+    # Process claims within the loss date window to find the latest one
+    latest_claim = None
+    latest_create_time = None
 
-        # Convert input loss_date to datetime for comparison
-        input_loss_date_obj = datetime.fromisoformat(loss_date.replace("Z", "+00:00"))
+    for claim in claim_index.find(policy_number, loss_date, max_difference_hours):
+        difference = abs(claim["LossTime"] - input_loss_time) / 3600  # Difference in hours
 
-        # Process claims to find the latest one matching the loss date within the threshold
-        latest_claim = None
-        latest_create_date = None
+        if difference >= max_difference_hours or claim["CreateTime"] is None:
+            continue
 
-        for claim in claim_data:
-            print(f"[DEBUG] Checking claim {claim.get('ClaimNumber')}")
-            
-            claim_loss_date_str = claim.get("LossDate")
-            if not claim_loss_date_str:
-                print("[DEBUG] Claim has no LossDate.")
-                continue
-            
-            claim_loss_date_obj = datetime.fromisoformat(claim_loss_date_str.replace("Z", "+00:00"))
-            difference = abs((claim_loss_date_obj - input_loss_date_obj).total_seconds()) / 3600  # Difference in hours
-            
-            print(f"[DEBUG] LossDate difference in hours: {difference:.2f}")
-
-            if difference < max_difference_hours:
-                print(f"[DEBUG] LossDate within {max_difference_hours} hours: {claim_loss_date_str}")
-                create_dates = [exposure.get("CreateDate") for exposure in claim.get("Exposures", []) if exposure.get("CreateDate")]
-                print(f"[DEBUG] Found {len(create_dates)} create dates in exposures.")
-                
-                for date_str in create_dates:
-                    print(f"[DEBUG] Parsing CreateDate: {date_str}")
-                    date_obj = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-                    if latest_create_date is None or date_obj > latest_create_date:
-                        print(f"[DEBUG] Updating latest create date to {date_obj}")
-                        latest_create_date = date_obj
-                        latest_claim = {
-                            "LossDate": claim_loss_date_str,
-                            "ClaimNumber": claim.get("ClaimNumber"),
-                            "CreateDate": date_str,
-                            "PolicyType": claim.get("PolicyType"),
-                            "ClaimStatus": claim.get("ClaimStatus"),
-                            "PolicyNumber": claim.get("PolicyNumber"),
-                            "Status": "Duplicate",
-                            "LossDateDifferenceHours": round(difference, 2)
-                        }
-            else:
-                print(f"[DEBUG] LossDate difference too large: {claim_loss_date_str}")
-
-        if not latest_claim:
-            print("[DEBUG] No matching claims found.")
-            return None
-        
-        print(f"[DEBUG] Latest matching claim found: {latest_claim}")
+        if latest_create_time is None or claim["CreateTime"] > latest_create_time:
+            latest_create_time = claim["CreateTime"]
+            latest_claim = {
+                "LossDate": claim["LossDate"],
+                "ClaimNumber": claim["ClaimNumber"],
+                "CreateDate": claim["CreateDate"],
+                "PolicyType": claim["PolicyType"],
+                "ClaimStatus": claim["ClaimStatus"],
+                "PolicyNumber": claim["PolicyNumber"],
+                "Status": "Duplicate",
+                "LossDateDifferenceHours": round(difference, 2)
+            }
+    return latest_claim
+
+
+# Function to validate claim based on policy number and loss date with a difference check
+@timed("validate_claim")
+def validate_claim(policy_number, loss_date, max_difference_hours=24):
+    logger.debug("Starting claim validation for PolicyNumber: %s and LossDate: %s", policy_number, loss_date)
+
+    # A claim already in the local index is a duplicate without asking ClaimCenter
+    latest_claim = find_latest_claim(policy_number, loss_date, max_difference_hours)
+    if latest_claim:
+        logger.debug("Latest matching claim found locally: %s", latest_claim)
         return latest_claim
 
+    # A miss is checked against ClaimCenter, it may hold claims created by another node or channel
+    try:
+        refresh_status = refresh_claim_history(policy_number)
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] API request exception occurred: {e}")
+        logger.error("getClaimDetails request failed: %s", e)
         return None
 
+    if refresh_status == "Refreshed":
+        latest_claim = find_latest_claim(policy_number, loss_date, max_difference_hours)
+        if latest_claim:
+            logger.debug("Latest matching claim found: %s", latest_claim)
+            return latest_claim
+
+    logger.debug("No matching claims found.")
+    if refresh_status == "NoClaims":
+        return {"Status": "New"}
+    return None
+
+# JSON mode schema of the duplicate check answer
+DUPLICATE_RESULT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "policyNumber": {"type": "STRING"},
+        "claimNumber": {"type": "STRING"},
+        "lossDate": {"type": "STRING"},
+        "claimStatus": {"type": "STRING"},
+        "status": {"type": "STRING", "format": "enum", "enum": ["duplicate", "new"]},
+    },
+    "required": ["status"],
+}
+
+
 # Function to call AI service to verifuy duplicate claims
 def validate_Duplicate_Claim(policy_number, cleaned_text):
     """
@@ -110,18 +127,13 @@ def validate_Duplicate_Claim(policy_number, cleaned_text):
         #print(f"[DEBUG] Input Policy Number: {policy_number}")
         #print(f"[DEBUG] Cleaned Text (truncated): {cleaned_text[:200]}...")  # Avoid printing huge text
 
-        # 1️⃣ API Endpoint & Headers
-        url = "http://18.218.57.115:8090/cc/rest/claimdetails/v1/getClaimDetails"
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': 'Basic c3U6Z3c='
-        }
+        # 1️⃣ API Payload
         payload = {
             "PolicyNumber": str(policy_number)
         }
      
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = guidewire.post("getClaimDetails", json.dumps(payload))
 
         if response.status_code != 200:
            # print(f"[ERROR] Get Claim API failed: {response.status_code} - {response.text}")
@@ -136,7 +148,7 @@ def validate_Duplicate_Claim(policy_number, cleaned_text):
 
         # 2️⃣ Quick check before AI
         if not claim_data or "no claim" in json.dumps(claim_data).lower():
-            print("[DEBUG] No claim data found in API response. Returning None.")
+            logger.debug("No claim data found in API response. Returning None.")
             return None
 
         # 3️⃣ Build AI prompt
@@ -182,21 +194,11 @@ extract the details of the latest claim as follows, return ONLY this JSON:
 
         # 4️⃣ Call AI
        
-        ai_result = get_ai_content(prompt)
-        print("AI Result:", ai_result)
-
-        # 🛠 Clean AI output before parsing
-        try:
-            import re
-            cleaned_ai_result = re.sub(r"^```[a-zA-Z]*\s*|```$", "", ai_result.strip(), flags=re.MULTILINE).strip()
-            # print(f"[DEBUG] Cleaned AI Result: {cleaned_ai_result}")
-            result_json = json.loads(cleaned_ai_result)
-            # print(f"[DEBUG] Parsed AI JSON: {result_json}")
-        except Exception as e:
-            #print(f"[ERROR] Failed to parse AI output as JSON after cleaning: {e}")
-            result_json = None
+        ai_result = get_ai_content(prompt, response_schema=DUPLICATE_RESULT_SCHEMA)
+        logger.debug("AI result: %s", ai_result)
 
-        return result_json
+        result_json = parse_json_response(ai_result)
+        return result_json if isinstance(result_json, dict) else None
 
     except Exception as e:
         #print(f"[ERROR] Exception in validate_Duplicate_Claim: {e}")